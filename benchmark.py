@@ -0,0 +1,463 @@
+#!/usr/bin/python3
+
+""" Benchmarks on synthetic archives """
+
+import argparse
+import datetime
+import email
+import gzip
+import io
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+import dates
+import get_emails
+import mail_threads
+import patches
+import replay
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+
+def synthetic_mbox(count, author_every=50, body_lines=40, year=2016,
+                   month=8):
+    """
+    Return an mbox of count messages as bytes. Every author_every-th
+    message is sent by foo@example.com, half of them with a patch.
+    """
+    messages = []
+    for index in range(count):
+        date = datetime.datetime(year, month, 1 + index % 28, index % 24)
+        if index % author_every == 0:
+            sender = 'Foo Bar <foo@example.com>'
+        else:
+            sender = 'Someone {0} <someone{0}@example.org>'.format(index)
+        body = ['Line {} of the message body.\n'.format(line)
+                for line in range(body_lines)]
+        if index % 2:
+            subject = '[PATCH {}/2] subsystem: change {}'.format(
+                    index % 2 + 1, index)
+            body += ['---\n', ' file.c | 2 +-\n', '\n',
+                     'diff --git a/file.c b/file.c\n',
+                     '--- a/file.c\n', '+++ b/file.c\n',
+                     '@@ -1 +1 @@\n', '-old\n', '+new\n']
+        else:
+            subject = 'Re: [PATCH] subsystem: change {}'.format(index - 1)
+        messages.append(
+            'From someone  {0}\n'
+            'From: {1}\n'
+            'Date: {2}\n'
+            'Subject: {3}\n'
+            'Message-ID: <{7}{8:02}.{4}@example.org>\n'
+            'In-Reply-To: <{7}{8:02}.{5}@example.org>\n'
+            '\n'
+            '{6}\n'.format(
+                date.strftime('%a %b %d %H:%M:%S %Y'), sender,
+                date.strftime('%a, %d %b %Y %H:%M:%S +0000'), subject,
+                index, index - 1, ''.join(body), year, month))
+    return ''.join(messages).encode('utf-8')
+
+
+def bench_prefilter(args):
+    """ Messages/sec of parsing every message vs the header prefilter """
+    archive = gzip.compress(synthetic_mbox(args.messages))
+    # The patterns of GzipArchived for the author of synthetic_mbox()
+    patterns = ['foo@example.com', 'foo at example.com']
+
+    def scan(header_filter):
+        box = get_emails.mboxStream(
+                gzip.GzipFile(fileobj=io.BytesIO(archive)), header_filter)
+        for raw_message in box:
+            message = email.message_from_bytes(raw_message)
+            any(match in (message['from'] or '') for match in patterns)
+
+    def full_parse():
+        scan(None)
+
+    def prefilter():
+        scan(get_emails.HeaderFilter(patterns))
+
+    print('{} messages, {} KiB compressed'.format(args.messages,
+                                                  len(archive) // 1024))
+    for label, function in (('full parse', full_parse),
+                            ('header prefilter', prefilter)):
+        best = min(timed(function) for _ in range(args.repeat))
+        print('{:>20}: {:>10.0f} messages/sec'.format(
+            label, args.messages / best))
+
+
+def bench_patches(args):
+    """ Messages/sec of per-line patch detection vs patches.diffstat """
+    raw_messages = list(get_emails.mboxStream(
+            io.BytesIO(synthetic_mbox(args.messages))))
+
+    def per_line():
+        for raw_message in raw_messages:
+            message = email.message_from_bytes(raw_message)
+            lines = message.as_string().split("\n")
+            patch_start = [index for index, line in enumerate(lines)
+                           if re.match('^--- .*', line)]
+            for start in patch_start:
+                if start + 2 < len(lines):
+                    re.match(r'^\+\+\+ .*', lines[start + 1])
+                    re.match('^@@ .*', lines[start + 2])
+
+    def single_pass():
+        for raw_message in raw_messages:
+            patches.diffstat(raw_message.decode('utf-8', 'replace'))
+
+    print('{} messages'.format(args.messages))
+    for label, function in (('per line', per_line),
+                            ('single pass', single_pass)):
+        best = min(timed(function) for _ in range(args.repeat))
+        print('{:>20}: {:>10.0f} messages/sec'.format(
+            label, args.messages / best))
+
+
+def date_corpus(count, seed=0):
+    """
+    Return count date strings as found in archives: Date headers of
+    mails, Spinics X-Date comments and LKML listing dates.
+    """
+    rand = random.Random(seed)
+    zones = ['+0000', '-0700', '+0200', '+0800 (CST)', '-0400 (EDT)', 'GMT']
+    corpus = []
+    start = datetime.datetime(2016, 1, 1)
+    for _ in range(count):
+        date = start + datetime.timedelta(seconds=rand.randrange(86400 * 365))
+        kind = rand.random()
+        if kind < 0.6:
+            corpus.append(date.strftime('%a, %d %b %Y %H:%M:%S ') +
+                          rand.choice(zones))
+        elif kind < 0.8:
+            corpus.append(date.strftime('%a %b %d %Y - %H:%M:%S EST'))
+        else:
+            corpus.append(date.strftime('%a, {} %b %Y %H:%M:%S -0000').format(
+                date.day))
+    return corpus
+
+
+def bench_dates(args):
+    """ Parses/sec of dateparser vs dates.parse_date """
+    import dateparser
+    corpus = date_corpus(args.dates)
+
+    def fuzzy():
+        for text in corpus:
+            dateparser.parse(text)
+
+    def fast_cold():
+        dates.parse_date.cache_clear()
+        for text in corpus:
+            dates.parse_date(text)
+
+    def fast_warm():
+        for text in corpus:
+            dates.parse_date(text)
+
+    print('{} dates, {} distinct'.format(len(corpus), len(set(corpus))))
+    for label, function in (('dateparser', fuzzy),
+                            ('parse_date', fast_cold),
+                            ('parse_date cached', fast_warm)):
+        best = min(timed(function) for _ in range(args.repeat))
+        print('{:>20}: {:>10.0f} parses/sec'.format(
+            label, len(corpus) / best))
+
+
+def message_corpus(count, authors=10, thread_size=5, year=2016):
+    """
+    Yield (author, message id, subject, date, in-reply-to) of count mails
+    of authors sent over a year, in threads of a patch and its replies.
+    Subjects are built for every mail, as they are when parsed.
+    """
+    start = datetime.date(year, 1, 1)
+    for index in range(count):
+        date = start + datetime.timedelta(days=index * 365 // count)
+        subject = '[PATCH] subsystem: change {}'.format(index // thread_size)
+        in_reply_to = None
+        if index % thread_size:
+            subject = 'Re: ' + subject
+            in_reply_to = '{}@example.org'.format(index - 1)
+        yield (index % authors, '{}@example.org'.format(index), subject,
+               date, in_reply_to)
+
+
+def build_records(kind, count):
+    """
+    Keep the mails of message_corpus(count) the way the retrievers did,
+    as {author: {message-id: (subject, str(date))}}, or as message
+    records, and print the time it took
+    """
+    list_key = 'http://lists.example.org/pipermail/bench'
+    emails = {}
+    start = time.perf_counter()
+    for author, message_id, subject, date, in_reply_to in \
+            message_corpus(count):
+        if kind == 'tuples':
+            record = (subject, str(date))
+        elif kind == 'records':
+            record = mail_threads.Message(message_id, subject, date,
+                                          in_reply_to, lists=(list_key,))
+        else:
+            continue
+        emails.setdefault(author, {})[message_id] = record
+    print('built in {:.2f} s'.format(time.perf_counter() - start))
+    return emails
+
+
+def bench_records(args):
+    """ Peak RSS of the mails found kept as tuples and as records """
+    code = ('import sys, benchmark\n'
+            'emails = benchmark.build_records(sys.argv[1], int(sys.argv[2]))')
+    print('{} messages'.format(args.messages))
+    print('{:>10} {:>9} {:>9} {:>12}'.format('kind', 'RSS MiB', 'over base',
+                                             'bytes/mail'))
+    base = None
+    for kind in ('none', 'tuples', 'records'):
+        rss = min(run_probed(['-c', code, kind, str(args.messages)],
+                             os.path.dirname(MAIN))[1]
+                  for _ in range(args.repeat))
+        if base is None:
+            base = rss
+        print('{:>10} {:>9.1f} {:>9.1f} {:>12.0f}'.format(
+            kind, rss / 1024, (rss - base) / 1024,
+            (rss - base) * 1024 / args.messages))
+
+
+def synthetic_lkml(recording, months, messages, weeks, author_every=50):
+    """
+    Record weeks author.html listings per month of LKML, with messages
+    messages per month, the pages of the mails of foo@example.com and the
+    index of the archive listing the weeks.
+    """
+    directories = []
+    for year, month in months:
+        for week in range(weeks):
+            directory = '{0:02}{1:02}.{2}/'.format(year % 100, month, week)
+            directories.append('<a href="{0}index.html">{0}</a>'.format(
+                directory))
+            base = get_emails.LKML.url_base + directory
+            sections = {}
+            for index in range(messages // weeks):
+                date = datetime.datetime(year, month,
+                                         1 + min(27, week * 7 + index % 7),
+                                         index % 24)
+                if index % author_every == 0:
+                    name = 'Foo Bar'
+                    record(recording, '{0}{1:04}.html'.format(base, index),
+                           '<html>\n'
+                           '<!--X-Message-Id: {0}.{1}&#45;{2}@example.org '
+                           '-->\n'
+                           '<p>From: Foo Bar &lt;foo@xxxxxxxxxxx&gt;</p>\n'
+                           '</html>\n'.format(month, week, index))
+                else:
+                    name = 'Someone {}'.format(index % 20)
+                sections.setdefault(name, []).append(
+                    '<li><b><i><a name="{0}" href="{0:04}.html">Subject {0}'
+                    '</a>&nbsp;<a name="{0}"><em>{1}</em></a></li>'.format(
+                        index, date.strftime('%a %b %d %Y - %H:%M:%S EST')))
+            lines = ['<html><body><ul>']
+            for name in sorted(sections):
+                lines.append('<li><strong>{}</strong>'.format(name))
+                lines.extend(sections[name])
+            lines.append('</ul></body></html>')
+            record(recording, base + 'author.html', '\n'.join(lines) + '\n')
+    record(recording, get_emails.LKML.url_base + 'index.html',
+           '\n'.join(directories) + '\n')
+
+
+def synthetic_spinics(recording, months, messages, author_every=50,
+                      per_page=100):
+    """
+    Record the listing pages of a Spinics list with messages messages in
+    each of months and in the month before, newest first, and the pages
+    of the mails of foo@example.com.
+    """
+    base = '{0}bench/'.format(get_emails.Spinics.url_base)
+    first = datetime.date(*months[0], 1) - datetime.timedelta(days=1)
+    months = [(first.year, first.month)] + months
+    items = []
+    for year, month in reversed(months):
+        for index in reversed(range(messages)):
+            number = len(items)
+            date = datetime.datetime(year, month, 1 + index % 28, index % 24)
+            if index % author_every == 0:
+                sender = 'Foo Bar &lt;foo@xxxxxxxxxxx&gt;'
+                record(recording, '{0}msg{1}.html'.format(base, number),
+                       '<html>\n<!--X-Date: {0} -->\n'
+                       '<!--X-Message-Id: {1}@example.org -->\n'
+                       '<body>x</body>\n</html>\n'.format(
+                           date.strftime('%a, %d %b %Y %H:%M:%S +0000'),
+                           number))
+            else:
+                sender = 'Someone {0} &lt;someone{0}@xxxxxxxxxxx&gt;'.format(
+                        index % 20)
+            items.append('<li><a name="{0}" href="msg{0}.html">Subject {0}'
+                         '</a><ul><li><strong>From</strong>: {1}</li></ul>'
+                         '</li>'.format(number, sender))
+    for page in range(0, len(items), per_page):
+        name = 'mail{}.html'.format(page // per_page + 1) if page else \
+            'maillist.html'
+        record(recording, base + name, '<html><body><ul>{}</ul></body>'
+               '</html>'.format(''.join(items[page:page + per_page])))
+
+
+def synthetic_gz(recording, retriever, url, months, messages):
+    """ Record the mbox archives of the bench list of a GzipArchived """
+    archives = types.SimpleNamespace(url_base=url)
+    for year, month in months:
+        record(recording, retriever._archive_url(archives, 'bench', year,
+                                                 month),
+               gzip.compress(synthetic_mbox(messages, year=year,
+                                            month=month)))
+
+
+def record(recording, url, body):
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    recording.store(url, 200, [('Content-Type', 'text/html')],
+                    io.BytesIO(body))
+
+
+# Configuration of main.py searching the synthetic list of every backend
+BACKENDS = {
+    'lkml': '[lkml]\n',
+    'spinics': '[bench]\ntype = spinics\nlistnames = bench\n',
+    'pipermail': '[bench]\ntype = pipermail\n'
+                 'url = http://lists.example.org/pipermail/\n'
+                 'listnames = bench\n',
+    'hyperkitty': '[bench]\ntype = hyperkitty\n'
+                  'url = https://lists.example.org/archives/\n'
+                  'listnames = bench\n',
+}
+
+
+def bench_end_to_end(args):
+    """ Wall time, requests, bytes and peak RSS of main.py per backend """
+    months = [(2016, month) for month in range(1, args.months + 1)]
+    with tempfile.TemporaryDirectory() as tmp:
+        recording = replay.Recording(os.path.join(tmp, 'recording'))
+        synthetic_lkml(recording, months, args.messages, args.weeks)
+        synthetic_spinics(recording, months, args.messages)
+        synthetic_gz(recording, get_emails.Pipermail,
+                     'http://lists.example.org/pipermail/', months,
+                     args.messages)
+        synthetic_gz(recording, get_emails.HyperKitty,
+                     'https://lists.example.org/archives/', months,
+                     args.messages)
+        server = replay.ReplayServer(recording.path)
+        server.start()
+        print('{} months of {} messages, {} LKML weeks'.format(
+            len(months), args.messages, len(months) * args.weeks))
+        print('{:>12} {:>9} {:>9} {:>10} {:>9} {:>7}'.format(
+            'backend', 'wall s', 'requests', 'KiB sent', 'RSS MiB', 'found'))
+        try:
+            for backend in args.backends:
+                home = os.path.join(tmp, backend)
+                os.makedirs(home)
+                with open(os.path.join(home, '.list_archive'), 'w') as config:
+                    config.write('[general]\nname = Foo Bar\n'
+                                 'email = foo@example.com\n\n')
+                    config.write(BACKENDS[backend])
+                arguments = ['--since', '2016-01',
+                             '--until', '2016-{:02}'.format(args.months),
+                             '--replay', server.url,
+                             '--processes', str(args.processes)]
+                runs = []
+                for _ in range(args.repeat):
+                    server.reset()
+                    runs.append(run_main(home, arguments) + server.reset())
+                wall, rss, output, requests, sent = min(runs)
+                found = re.search(r'(\d+) meesages found', output)
+                print('{:>12} {:>9.2f} {:>9} {:>10.0f} {:>9.1f} {:>7}'.format(
+                    backend, wall, requests, sent / 1024, rss / 1024,
+                    found.group(1) if found else '-'))
+        finally:
+            server.close()
+
+
+# ru_maxrss keeps the peak RSS of a process from before it executed its
+# program, so main.py is started by this small process rather than by the
+# benchmark, which holds the synthetic archives
+RSS_PROBE = """
+import os, sys
+pid = os.fork()
+if pid == 0:
+    os.execv(sys.executable, [sys.executable] + sys.argv[1:])
+_, status, usage = os.wait4(pid, 0)
+print('peak RSS {}'.format(usage.ru_maxrss))
+"""
+
+
+def run_main(home, arguments):
+    """
+    Run main.py with HOME set to home, return (wall time, peak RSS in KiB,
+    output)
+    """
+    return run_probed([MAIN] + arguments, home, dict(os.environ, HOME=home))
+
+
+def run_probed(arguments, cwd, env=None):
+    """
+    Run python with arguments in cwd, return (wall time, peak RSS in KiB,
+    output)
+    """
+    start = time.perf_counter()
+    output = subprocess.run(
+            [sys.executable, '-c', RSS_PROBE] + arguments, cwd=cwd, env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL).stdout.decode('utf-8', 'replace')
+    wall = time.perf_counter() - start
+    output, _, rss = output.rpartition('peak RSS ')
+    return wall, int(rss), output
+
+
+def timed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=3)
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    prefilter = commands.add_parser('prefilter',
+                                    help=bench_prefilter.__doc__)
+    prefilter.add_argument('--messages', type=int, default=5000)
+    prefilter.set_defaults(function=bench_prefilter)
+    patch = commands.add_parser('patches', help=bench_patches.__doc__)
+    patch.add_argument('--messages', type=int, default=5000)
+    patch.set_defaults(function=bench_patches)
+    date = commands.add_parser('dates', help=bench_dates.__doc__)
+    date.add_argument('--dates', type=int, default=500)
+    date.set_defaults(function=bench_dates)
+    end_to_end = commands.add_parser('end-to-end',
+                                     help=bench_end_to_end.__doc__)
+    end_to_end.add_argument('--messages', type=int, default=2000,
+                            help='messages of every list in each month')
+    end_to_end.add_argument('--months', type=int, default=6,
+                            choices=range(1, 13))
+    end_to_end.add_argument('--weeks', type=int, default=5,
+                            help='LKML weeks in each month')
+    end_to_end.add_argument('--backends', nargs='+', choices=list(BACKENDS),
+                            default=list(BACKENDS))
+    end_to_end.add_argument('--processes', type=int, default=0,
+                            help='processes parsing mbox archives')
+    end_to_end.set_defaults(function=bench_end_to_end)
+    records = commands.add_parser('records', help=bench_records.__doc__)
+    records.add_argument('--messages', type=int, default=100000)
+    records.set_defaults(function=bench_records)
+    args = parser.parse_args()
+    args.function(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,31 +2,127 @@
 
 import argparse
 import configparser
+import copy
+import datetime
 import os
+import re
 import sys
 
+import dates
+
 CONFIG_GLOBAL = os.path.expanduser("~/.list_archive")
 CONFIG_LOCAL = os.path.expanduser("./config")
 
 
+class Author(object):
+    """ Person whose mails are searched for """
+    def __init__(self, name, email):
+        self.name = name
+        self.email = email
+
+    def __repr__(self):
+        return '{0} {1}'.format(self.name, ' '.join(
+            '<' + email.strip("'") + '>' for email in self.email))
+
+
+def read_roster(path):
+    """
+    Read authors from a roster file, one per line in the form of
+    `Name <email> <email>`. Empty lines and lines starting with # are
+    ignored.
+    """
+    authors = []
+    with open(os.path.expanduser(path)) as roster:
+        for line in roster:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            name = line.split('<')[0].strip()
+            emails = re.findall('<([^>]+)>', line)
+            if not name or not emails:
+                print('Ignoring invalid roster line: {0}'.format(line),
+                      file=sys.stderr)
+                continue
+            authors.append(Author(name, emails))
+    return authors
+
+
 class GeneralConfig(object):
     """ General option class """
     def __init__(self, arguments=None):
         self.parser = None
         self.name = None
         self.email = None
+        self.authors = []
+        self.team = []
         self.month = None
         self.year = None
+        # All searched months as (year, month), and the searched range
+        # of dates, last_day excluded
+        self.months = []
+        self.first_day = None
+        self.last_day = None
         self.debug = False
+        self.jobs = 4
+        self.per_host = 2
+        self.detail_workers = 8
+        # Processes parsing mbox archives, 0 to parse them in the threads
+        # fetching them
+        self.processes = 0
+        self.connections = 4
+        self.compress = True
+        # Requests time out after timeout seconds and are retried after
+        # exponential backoff, hosts failing breaker_failures times in a
+        # row are not asked for breaker_reset seconds, and a run fetches
+        # nothing after budget seconds, 0 for no limit
+        self.timeout = 10
+        self.retries = 3
+        self.backoff = 0.5
+        self.breaker_failures = 10
+        self.breaker_reset = 60
+        self.budget = 0
+        self.cache = True
+        # None stands for the default locations, see http_cache.CACHE_DIR
+        # and message_index.INDEX_PATH
+        self.cache_dir = None
+        self.cache_size = 512
+        self.cache_ttl = 3600
+        self.refresh = False
+        self.index = None
+        self.ingest = False
+        self.from_index = False
+        self.record = None
+        self.replay = None
+        self.stats = False
+        self.stats_json = None
+        self.trace = None
         self.lkml = []
         self.spinics = []
         self.pipermail = {}
         self.hyperkitty = {}
+        # Glob patterns of local mbox files
+        self.localmbox = []
         self._get_options(arguments)
 
     def _get_options(self, arguments=None):
         raise NotImplementedError
 
+    def _set_months(self, first, last):
+        """ Search months from first to last, both (year, month) """
+        self.months = dates.month_range(first, last)
+        self.year, self.month = first
+        self.first_day = dates.month_bounds(*first)[0]
+        self.last_day = dates.month_bounds(*last)[1]
+
+    def with_months(self, months):
+        """ Return a copy of the options searching only months """
+        options = copy.copy(self)
+        options.months = list(months)
+        options.year, options.month = months[0]
+        options.first_day = dates.month_bounds(*months[0])[0]
+        options.last_day = dates.month_bounds(*months[-1])[1]
+        return options
+
 
 class Config(GeneralConfig):
     """ Parse configuration file and command line arguments """
@@ -54,7 +150,54 @@ class Config(GeneralConfig):
                           self.parser['general']['email'].split()]
         except KeyError as key_not_found:
             print('{0} not configured in {1}'.format(key_not_found,
-                                                     CONFIG), file=std.stderr)
+                                                     CONFIG), file=sys.stderr)
+        # Concurrency limits of the fetch scheduler
+        self.jobs = self.parser.getint('general', 'jobs',
+                                       fallback=self.jobs)
+        self.per_host = self.parser.getint('general', 'per_host',
+                                           fallback=self.per_host)
+        self.detail_workers = self.parser.getint(
+                'general', 'detail_workers', fallback=self.detail_workers)
+        self.processes = self.parser.getint('general', 'processes',
+                                            fallback=self.processes)
+        # Keep-alive connections opened at most to each host, and gzip
+        # compression of transferred pages
+        self.connections = self.parser.getint('general', 'connections',
+                                              fallback=self.connections)
+        self.compress = self.parser.getboolean('general', 'compress',
+                                               fallback=self.compress)
+        # Timeouts, retries and circuit breaking of requests
+        self.timeout = self.parser.getfloat('general', 'timeout',
+                                            fallback=self.timeout)
+        self.retries = self.parser.getint('general', 'retries',
+                                          fallback=self.retries)
+        self.backoff = self.parser.getfloat('general', 'backoff',
+                                            fallback=self.backoff)
+        self.breaker_failures = self.parser.getint(
+                'general', 'breaker_failures', fallback=self.breaker_failures)
+        self.breaker_reset = self.parser.getfloat(
+                'general', 'breaker_reset', fallback=self.breaker_reset)
+        self.budget = self.parser.getfloat('general', 'budget',
+                                           fallback=self.budget)
+        # Persistent HTTP cache, size is in MiB and ttl in seconds
+        self.cache = self.parser.getboolean('general', 'cache',
+                                            fallback=self.cache)
+        cache_dir = self.parser.get('general', 'cache_dir', fallback=None)
+        if cache_dir:
+            self.cache_dir = os.path.expanduser(cache_dir)
+        self.cache_size = self.parser.getint('general', 'cache_size',
+                                             fallback=self.cache_size)
+        self.cache_ttl = self.parser.getint('general', 'cache_ttl',
+                                            fallback=self.cache_ttl)
+        index = self.parser.get('general', 'index', fallback=None)
+        if index:
+            self.index = os.path.expanduser(index)
+
+        # Authors searched for with --team, from the roster file and
+        # [author ...] sections
+        roster = self.parser.get('general', 'roster', fallback=None)
+        if roster:
+            self.team.extend(read_roster(roster))
 
         for section in self.parser.sections():
             if section == 'general':
@@ -62,7 +205,15 @@ class Config(GeneralConfig):
             elif section == 'lkml' or section == 'LKML':
                 self.lkml = True
                 continue
+            elif section.startswith('author '):
+                self.team.append(Author(
+                    self.parser[section]['name'],
+                    self.parser[section]['email'].split()))
+                continue
             list_type = self.parser[section]['type']
+            if list_type == 'localmbox':
+                self.localmbox.extend(self.parser[section]['path'].split())
+                continue
             list_names = self.parser[section]['listnames'].split()
             if list_type == 'pipermail':
                 list_url = self.parser[section]['url']
@@ -72,14 +223,84 @@ class Config(GeneralConfig):
                 self.hyperkitty.update({list_url: list_names})
             elif list_type == 'spinics':
                 self.spinics = list_names
+        if self.name is not None and self.email is not None:
+            self.authors = [Author(self.name, self.email)]
         if arguments is None:
             return
         self.parser = argparse.ArgumentParser()
         self.parser.add_argument('--month')
-        self.parser.add_argument('--year')
+        self.parser.add_argument('--year',
+                                 help='without --month, the whole year is '
+                                      'searched')
+        self.parser.add_argument('--since', metavar='YYYY-MM',
+                                 help='first month searched')
+        self.parser.add_argument('--until', metavar='YYYY-MM',
+                                 help='last month searched, the current '
+                                      'month by default')
         self.parser.add_argument('--name')
         self.parser.add_argument('--email')
+        self.parser.add_argument('-t', '--team', action='store_true',
+                                 help='search for all authors of the roster '
+                                      'and [author ...] sections at once')
+        self.parser.add_argument('--roster',
+                                 help='roster file of authors, implies '
+                                      '--team')
         self.parser.add_argument('-d', '--debug', action='store_true')
+        self.parser.add_argument('-j', '--jobs', type=int,
+                                 help='lists searched concurrently')
+        self.parser.add_argument('--per-host', type=int,
+                                 help='lists searched concurrently on the '
+                                      'same host, 0 for no limit')
+        self.parser.add_argument('--detail-workers', type=int,
+                                 help='message pages fetched concurrently '
+                                      'for each list')
+        self.parser.add_argument('--processes', type=int,
+                                 help='processes parsing mbox archives, 0 '
+                                      'to parse them in the fetching '
+                                      'threads')
+        self.parser.add_argument('--connections', type=int,
+                                 help='connections opened at most to each '
+                                      'host')
+        self.parser.add_argument('--no-compress', action='store_true',
+                                 help='do not ask for compressed pages')
+        self.parser.add_argument('--timeout', type=float,
+                                 help='seconds to wait for an answer')
+        self.parser.add_argument('--retries', type=int,
+                                 help='times a failed request is sent again')
+        self.parser.add_argument('--budget', type=float,
+                                 help='seconds after which nothing more is '
+                                      'fetched, the results are reported as '
+                                      'incomplete')
+        self.parser.add_argument('--no-cache', action='store_true',
+                                 help='do not use the HTTP cache')
+        self.parser.add_argument('--refresh', action='store_true',
+                                 help='revalidate every cached page')
+        self.parser.add_argument('--ingest', action='store_true',
+                                 help='store all messages of the searched '
+                                      'months in the local index')
+        self.parser.add_argument('--from-index', action='store_true',
+                                 help='answer from the local index without '
+                                      'fetching anything')
+        self.parser.add_argument('--index', help='path of the local index')
+        self.parser.add_argument('--record', metavar='DIR',
+                                 help='save every response to DIR')
+        self.parser.add_argument('--replay', metavar='DIR|URL',
+                                 help='answer requests with the responses '
+                                      'recorded in DIR, or by the replay '
+                                      'server at URL')
+        self.parser.add_argument('--stats', action='store_true',
+                                 help='print requests, bytes, timings and '
+                                      'messages scanned of every list')
+        self.parser.add_argument('--stats-json', metavar='FILE',
+                                 help='save the stats of every request and '
+                                      'page parsed to FILE')
+        self.parser.add_argument('--trace', metavar='FILE',
+                                 help='save a timeline of the requests and '
+                                      'parsing to FILE, in the Trace Event '
+                                      'Format')
+        self.parser.add_argument('--profile-startup', action='store_true',
+                                 help='print the time spent importing '
+                                      'modules and in each step of the run')
         opt, args = self.parser.parse_known_args(arguments)
         # Override name and email in the configuration file if
         # specified in command line
@@ -87,19 +308,80 @@ class Config(GeneralConfig):
             self.name = opt.name
             self.email = opt.email.split()
         # Exit if no year or month is specified
-        if opt.month and opt.year:
-            self.month = int(opt.month)
-            self.year = int(opt.year)
+        if opt.since:
+            today = datetime.date.today()
+            try:
+                first = dates.parse_month(opt.since)
+                last = dates.parse_month(opt.until) if opt.until else \
+                    (today.year, today.month)
+            except ValueError:
+                print("Months are specified as YYYY-MM", file=sys.stderr)
+                sys.exit(1)
+            if last < first:
+                print("--until is before --since", file=sys.stderr)
+                sys.exit(1)
+            self._set_months(first, last)
+        elif opt.month and opt.year:
+            self._set_months((int(opt.year), int(opt.month)),
+                             (int(opt.year), int(opt.month)))
+        elif opt.year:
+            self._set_months((int(opt.year), 1), (int(opt.year), 12))
         else:
             print("No year or month is specified", file=sys.stderr)
             sys.exit(1)
         if opt.debug:
             self.debug = True
+        if opt.jobs is not None:
+            self.jobs = opt.jobs
+        if opt.per_host is not None:
+            self.per_host = opt.per_host
+        if opt.detail_workers is not None:
+            self.detail_workers = opt.detail_workers
+        if opt.processes is not None:
+            self.processes = opt.processes
+        if opt.connections is not None:
+            self.connections = opt.connections
+        if opt.no_compress:
+            self.compress = False
+        if opt.timeout is not None:
+            self.timeout = opt.timeout
+        if opt.retries is not None:
+            self.retries = opt.retries
+        if opt.budget is not None:
+            self.budget = opt.budget
+        if opt.no_cache:
+            self.cache = False
+        if opt.refresh:
+            self.refresh = True
+        if opt.index:
+            self.index = opt.index
+        self.ingest = opt.ingest
+        self.from_index = opt.from_index
+        # Recorded and replayed runs always go to the network, or its
+        # stand-in
+        self.record = opt.record
+        self.replay = opt.replay
+        if self.record or self.replay:
+            self.cache = False
+        self.stats = opt.stats
+        self.stats_json = opt.stats_json
+        self.trace = opt.trace
+        if opt.roster:
+            self.team = read_roster(opt.roster)
+            opt.team = True
+        if opt.team:
+            # Exit if there is nobody in the team
+            if not self.team:
+                print("No authors are configured", file=sys.stderr)
+                sys.exit(1)
+            self.authors = self.team
+            return
         # Exit if no name or email is specified
         if self.name is None or \
            self.email is None:
             print("No name or email is specified", file=sys.stderr)
             sys.exit(1)
+        self.authors = [Author(self.name, self.email)]
 
 
 class Options(GeneralConfig):
@@ -126,10 +408,11 @@ class Options(GeneralConfig):
         self.pipermail = self._get_list_name(opt.pipermail)
         self.hyperkitty = self._get_list_name(opt.hyperkitty)
         self.spinics = self._get_list_name(opt.spinics)
-        self.month = int(opt.month)
-        self.year = int(opt.year)
+        self._set_months((int(opt.year), int(opt.month)),
+                         (int(opt.year), int(opt.month)))
         self.name = opt.name
         self.email = opt.email
+        self.authors = [Author(self.name, self.email)]
         if not all([self.email, self.name, self.month, self.year]):
             print('Make sure you have specified email, name, month and year')
             self.email = None
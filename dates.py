@@ -0,0 +1,92 @@
+""" Date helpers shared by option parsing and the archive retrievers """
+
+import datetime
+import functools
+import re
+
+# English month abbreviations, independent of the locale
+MONTHS = {name: index + 1 for index, name in enumerate(
+    ('jan', 'feb', 'mar', 'apr', 'may', 'jun',
+     'jul', 'aug', 'sep', 'oct', 'nov', 'dec'))}
+# Dates of hypermail (LKML) listings, e.g. Mon Aug 01 2016 - 10:00:00 EST
+HYPERMAIL_DATE = re.compile(r'\s*(?:\w+,?\s+)?([A-Za-z]{3})\w*\s+(\d{1,2}),?'
+                            r'\s+(\d{4})\s+-\s+\d{1,2}:\d{2}')
+
+
+def next_month(year, month):
+    """ Return (year, month) of the month after the given one """
+    if month == 12:
+        return year + 1, 1
+    return year, month + 1
+
+
+def month_range(first, last):
+    """ List (year, month) tuples from first to last, both included """
+    months = []
+    while first <= last:
+        months.append(first)
+        first = next_month(*first)
+    return months
+
+
+def month_bounds(year, month):
+    """ Return the first day of the month and of the month after it """
+    return (datetime.date(year, month, 1),
+            datetime.date(*next_month(year, month), 1))
+
+
+def parse_month(text):
+    """ Parse YYYY-MM into (year, month), raise ValueError if invalid """
+    date = datetime.datetime.strptime(text.strip(), '%Y-%m')
+    return date.year, date.month
+
+
+@functools.lru_cache(maxsize=8192)
+def parse_date(text):
+    """
+    Return the date of a date string found in archives, or None.
+
+    RFC 2822 dates (mail headers, Spinics X-Date) and hypermail listing
+    dates are parsed directly. Anything else goes to dateparser, which is
+    much slower and only imported when needed. Results are cached since
+    the same strings come up again and again.
+    """
+    if not text:
+        return None
+    date = _parse_hypermail(text) or _parse_rfc2822(text)
+    if date is not None:
+        return date
+    return _parse_fuzzy(text)
+
+
+def _parse_hypermail(text):
+    match = HYPERMAIL_DATE.match(text)
+    if match is None:
+        return None
+    month = MONTHS.get(match.group(1).lower())
+    if month is None:
+        return None
+    try:
+        return datetime.date(int(match.group(3)), month,
+                             int(match.group(2)))
+    except ValueError:
+        return None
+
+
+def _parse_rfc2822(text):
+    # email.utils pulls in the network modules, which the option parsing
+    # does not need
+    import email.utils
+    parsed = email.utils.parsedate_tz(text)
+    if parsed is None:
+        return None
+    try:
+        return datetime.date(*parsed[:3])
+    except ValueError:
+        return None
+
+
+def _parse_fuzzy(text):
+    import dateparser
+    date = dateparser.parse(text)
+    return date.date() if date is not None else None
@@ -1,37 +1,336 @@
 """ Retrieving emails from mailing list archives """
 
 import calendar
+import codecs
+import collections
+import concurrent.futures
+import contextlib
 import datetime
+import email
+import email.errors
+import email.header
+import glob
 import gzip
+import html
+import http.client
 import io
-import mailbox
+import json
+import mmap
+import os
+import queue
 import re
+import shutil
 import sys
-import urllib.request
-import dateparser
+import tempfile
+import threading
+import urllib.error
+import zlib
+from dates import month_bounds, next_month, parse_date
+import http_client
+import mail_threads
+import message_index
+import patches
 from html.parser import HTMLParser
 
 
-class mboxFromFile(mailbox.mbox):
-    """ Custom class for reading mbox from file object instead of path. """
-    def __init__(self, content, factory=None, create=True):
-        self._message_factory = mailbox.mboxMessage
+class mboxStream(object):
+    """
+    Read an mbox from a file object one message at a time.
+
+    Iterating yields the raw bytes of every message without its "From "
+    separator line. The file is read in chunks and only the message being
+    read is kept in memory, so the file object can be a decompressing
+    stream of any size. When header_filter is given, it is called with
+    the raw header block of every message and messages it rejects are
+    skipped without keeping their body. count is the number of messages
+    read so far, skipped ones included.
+    """
+    chunk_size = 64 * 1024
+    separator = b'\nFrom '
+
+    def __init__(self, content, header_filter=None):
         self._file = content
-        self._toc = None
-        self._next_key = 0
-        self._pending = False
-        self._pending_sync = False
-        self._locked = False
-        self._file_length = None
-        self._factory = factory
+        self._filter = header_filter
+        self.count = 0
+
+    def __iter__(self):
+        # A newline is prepended so that every message, including the
+        # first one, starts with the separator
+        data = bytearray(b'\n')
+        searched = 0
+        keep = None
+        while True:
+            start = data.find(self.separator, searched)
+            if start > 0:
+                message = self._message(data[:start], keep)
+                if message is not None:
+                    yield message
+                del data[:start]
+                searched, keep = 1, None
+                continue
+            if keep is None and self._filter is not None:
+                headers = self._headers(data)
+                if headers is not None:
+                    keep = self._filter(headers)
+            if keep is False and len(data) > len(self.separator):
+                # Drop the body of a skipped message while reading it
+                del data[:len(data) - len(self.separator)]
+            searched = max(len(data) - len(self.separator) + 1, 1)
+            chunk = self._file.read(self.chunk_size)
+            if not chunk:
+                break
+            data += chunk
+        message = self._message(data, keep)
+        if message is not None:
+            yield message
+
+    def _headers(self, data):
+        """ Return the header block of the message in data if complete """
+        if not data.startswith(self.separator):
+            return None
+        start = data.find(b'\n', 1) + 1
+        if start == 0:
+            return None
+        end = data.find(b'\n\n', start - 1)
+        crlf_end = data.find(b'\n\r\n', start - 1)
+        if end < 0 or 0 <= crlf_end < end:
+            end = crlf_end
+        if end < 0:
+            return None
+        return bytes(data[start:end + 1])
+
+    def _message(self, data, keep):
+        """ Return the message in data without its separator, or None """
+        # Skipped messages have lost their separator with their body
+        if keep is False:
+            self.count += 1
+            return None
+        if not data.startswith(self.separator):
+            return None
+        self.count += 1
+        if keep is None and self._filter is not None:
+            headers = self._headers(data)
+            if headers is None:
+                headers = bytes(data[data.find(b'\n', 1) + 1:])
+            if not self._filter(headers):
+                return None
+        start = data.find(b'\n', 1) + 1
+        if start == 0:
+            return b''
+        end = len(data)
+        # The blank line before the next "From " line is a separator
+        if data.endswith(b'\r\n\r\n'):
+            end -= 2
+        elif data.endswith(b'\n\n'):
+            end -= 1
+        return bytes(data[start:end])
+
+
+class AuthorMatcher(object):
+    """
+    Find which author a piece of text comes from.
+
+    The patterns of all authors, as returned by formatter(author), are
+    compiled into a single alternation, so matching costs about the same
+    for one author or for a whole team.
+    """
+    def __init__(self, authors, formatter):
+        self._authors = {}
+        for author in authors:
+            for pattern in formatter(author):
+                self._authors.setdefault(pattern, author)
+        # Longer patterns first, so that the longest one wins when one
+        # pattern is a prefix of another
+        self.patterns = sorted(self._authors, key=len, reverse=True)
+        self._regex = re.compile('|'.join(
+            re.escape(pattern) for pattern in self.patterns) or '(?!)')
+
+    def match(self, text):
+        """ Return the author whose pattern is found in text, or None """
+        found = self._regex.search(text)
+        if found is None:
+            return None
+        return self._authors[found.group()]
+
+
+class HeaderFilter(object):
+    """
+    Fast check of the raw header block of a message for senders.
+
+    Matches when the From field, including its folded lines, contains
+    one of patterns. It works on bytes so messages from other people are
+    never decoded or parsed.
+    """
+    from_field = re.compile(rb'^from:[^\n]*(?:\r?\n[ \t][^\n]*)*',
+                            re.IGNORECASE | re.MULTILINE)
+
+    def __init__(self, patterns):
+        self._patterns = re.compile(b'|'.join(
+            re.escape(pattern.encode('utf-8')) for pattern in patterns)
+            or b'(?!)')
+
+    def __call__(self, headers):
+        field = self.from_field.search(headers)
+        return field is not None and \
+            self._patterns.search(field.group()) is not None
+
+
+def _beautify_string(string):
+    if string is not None:
+        return ' '.join(string.split()).strip("<>")
+    return None
+
+
+def _header_text(value):
+    """
+    Text of a header value, with its encoded words decoded. Headers with
+    raw 8-bit bytes come as email.header.Header, whose bytes are read as
+    UTF-8.
+    """
+    if value is None:
+        return None
+    try:
+        chunks = email.header.decode_header(value)
+    except email.errors.HeaderParseError:
+        return str(value)
+    decoded = []
+    for text, charset in chunks:
+        if isinstance(text, bytes):
+            try:
+                text = text.decode(charset or 'ascii')
+            except (LookupError, UnicodeDecodeError):
+                text, charset = text.decode('utf-8', 'replace'), None
+        decoded.append((text, charset))
+    return str(email.header.make_header(decoded))
+
+
+def parse_message(raw_message):
+    """
+    Return (sender, message id, subject, date, in-reply-to, references,
+    diffstat) of the raw bytes of a message, diffstat is None when it has
+    no patch. Return None if the message can not be parsed.
+    """
+    try:
+        message = email.message_from_bytes(raw_message)
+        header = {name: _header_text(message[name]) for name in
+                  ('from', 'subject', 'message-id', 'in-reply-to',
+                   'references', 'date')}
+        subject = _beautify_string(header['subject']) or ''
+        message_id = _beautify_string(header['message-id'])
+        in_reply_to = mail_threads.parse_references(header['in-reply-to'])
+        in_reply_to = in_reply_to[0] if in_reply_to else None
+        references = mail_threads.parse_references(header['references'])
+        patch = patches.diffstat(raw_message.decode('utf-8', 'replace'))
+        return (header['from'], message_id, subject,
+                parse_date(header['date']), in_reply_to, references, patch)
+    except (ValueError, TypeError, LookupError,
+            email.errors.MessageError) as error:
+        # One broken mail must not stop the search of its archive
+        print("A message could not be parsed ({0})".format(error),
+              file=sys.stderr)
+        return None
+
+
+def split_mbox(mbox_file, size):
+    """
+    Yield pieces of at least size bytes of the mbox file object, cut at
+    messages. The file is read size bytes at a time, only the piece being
+    cut is kept in memory.
+    """
+    data = bytearray()
+    while True:
+        chunk = mbox_file.read(size)
+        if not chunk:
+            break
+        data += chunk
+        if len(data) < size:
+            continue
+        # Search the separator from the end of what was there before, a
+        # piece is cut as soon as it is large enough
+        end = data.rfind(b'\nFrom ', max(0, len(data) - len(chunk) - 5))
+        if end >= 0:
+            yield bytes(data[:end + 1])
+            del data[:end + 1]
+    if data:
+        yield bytes(data)
+
+
+def parse_mbox_piece(data, patterns=None):
+    """
+    Parse the messages of data, a piece of an mbox cut by split_mbox, in a
+    worker process. When patterns are given, messages from other senders
+    are skipped. Return (messages read, [parse_message() of the others]).
+    """
+    header_filter = HeaderFilter(patterns) if patterns is not None else None
+    box = mboxStream(io.BytesIO(data), header_filter)
+    messages = [message for message in map(parse_message, box)
+                if message is not None]
+    return box.count, messages
+
+
+class BackgroundReader(io.RawIOBase):
+    """
+    Raw reader of a file object which a thread reads to the end in the
+    background. A listing parsed as it is downloaded waits for the detail
+    pages of the mails it lists, its response must not keep one of the
+    connections to the host they need.
+    """
+    def __init__(self, content, chunk_size=64 * 1024):
+        self._chunks = queue.Queue()
+        self._pending = b''
+        threading.Thread(target=self._read, args=(content, chunk_size),
+                         daemon=True).start()
+
+    def _read(self, content, chunk_size):
+        try:
+            while True:
+                chunk = content.read1(chunk_size)
+                self._chunks.put(chunk)
+                if not chunk:
+                    break
+        except Exception as error:
+            self._chunks.put(error)
+        finally:
+            content.close()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self._pending:
+            chunk = self._chunks.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            if not chunk:
+                # Later reads are at the end too
+                self._chunks.put(chunk)
+                return 0
+            self._pending = chunk
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
 
 
 class SpinicsHTMLParser(HTMLParser):
-    in_li = False
-    inner_li = False
-    has_attrs = False
-    thread_list = []
-    cur = {}
+    """
+    Parser of Spinics listing pages. A page can be fed in pieces, the
+    mails listed so far are taken with pop_threads().
+    """
+    def __init__(self):
+        super().__init__()
+        self.in_li = False
+        self.inner_li = False
+        self.has_attrs = False
+        self.threads = []
+        self.href = None
+        self.subject = ''
+
+    def pop_threads(self):
+        """ Return the (href, subject, sender) parsed since last call """
+        threads, self.threads = self.threads, []
+        return threads
+
     def handle_starttag(self, tag, attrs):
         if tag == 'li':
             if not self.in_li:
@@ -40,10 +339,8 @@ class SpinicsHTMLParser(HTMLParser):
                 self.inner_li = True
         elif tag == 'a' and self.in_li and len(attrs) > 1:
             self.has_attrs = True
-            self.cur = {}
-            self.cur['attrs'] = attrs
-        elif tag == 'html':
-            self.thread_list = []
+            self.href = dict(attrs).get('href', attrs[1][1])
+            self.subject = ''
 
     def handle_endtag(self, tag):
         if tag == 'li':
@@ -56,256 +353,839 @@ class SpinicsHTMLParser(HTMLParser):
     def handle_data(self, data):
         if self.in_li:
             if self.inner_li and data != "From":
-                self.cur['email'] = data.strip(": ")
-                self.thread_list.append(self.cur)
+                if self.has_attrs:
+                    self.threads.append(
+                        (self.href, self.subject, data.strip(": ")))
             elif data != "From" and not data.isspace() and self.has_attrs:
-                self.cur['subject'] = data
+                self.subject = data
+
+
+# Archivers keep headers of a mail in comments of its detail page, MHonArc
+# its References as <!--X-Reference: id -->, hypermail its In-Reply-To as
+# <!-- inreplyto="id" -->
+X_REFERENCE = re.compile(rb'<!--X-Reference: (.*?) -->')
+IN_REPLY_TO = re.compile(rb'<!-- inreplyto="(.*?)" -->')
+
+
+def detail_references(page):
+    """ (in_reply_to, references) of the mail of a detail page """
+    references = tuple(html.unescape(reference.decode('utf-8', 'replace'))
+                       for reference in X_REFERENCE.findall(page))
+    in_reply_to = IN_REPLY_TO.search(page)
+    if in_reply_to is not None:
+        in_reply_to = html.unescape(in_reply_to.group(1).decode('utf-8',
+                                                                'replace'))
+    elif references:
+        in_reply_to = references[-1]
+    return in_reply_to, references
+
+
+# Client used by retrievers which are not given one, shared so that they
+# all reuse the same connections
+default_client = http_client.HTTPClient()
 
 
 class GeneralList(object):
     """ General list class """
 
-    def __init__(self, options, list_name=None, debug=False, timeout=10):
+    # Archives of a month may still receive late mails for a few days
+    # after the month is over
+    grace_days = 7
+    # Listings are parsed as they are downloaded, in pieces of this size
+    chunk_size = 64 * 1024
+    # Whether the mails of all senders are stored in the index, rather
+    # than those of the searched people
+    indexes_all_senders = False
+
+    def __init__(self, options, list_name=None, debug=False, timeout=10,
+                 workers=8, cache=None, index=None, client=None, stats=None):
         self.emails = {}
         print("Searching {0} From {1}".format(
             list_name, self.url_base), file=sys.stderr)
         self._debug = debug
         self._timeout = timeout
+        self._workers = max(1, workers)
+        self._cache = cache
+        self._client = client if client is not None else default_client
+        self._lock = threading.Lock()
+        self._index = index
+        self._index_rows = []
+        # {(year, month): url} of the months which could not be searched
+        # completely, with the first url which failed
+        self.incomplete = {}
+        # Messages found record the list they were found in
+        self._list_key = '{0}{1}'.format(self.url_base, list_name)
+        self._stats = stats
+        self._stats_name = '{0} {1}'.format(type(self).__name__, list_name)
+        with self._span('retrieve', self._stats_name):
+            if index is not None:
+                self._ingest(options, list_name)
+            else:
+                self._retrieve(options, list_name)
+
+    def _ingest(self, options, list_name=None):
+        """ Retrieve the months of the list missing from the index """
+        addresses = None
+        if not self.indexes_all_senders:
+            # Mails are stored under the first address of their author
+            addresses = [author.email[0].lower()
+                         for author in options.authors]
+        complete = self._index.complete_months(self._list_key, addresses)
+        months = [month for month in options.months
+                  if month not in complete]
+        if not months:
+            return
+        options = options.with_months(months)
         self._retrieve(options, list_name)
+        # Months are not recorded when the archive could not be reached,
+        # so they are retried next time
+        self._index.add(self._list_key, self._index_rows,
+                        [(month, self._month_over(*month))
+                         for month in months
+                         if month not in self.incomplete], addresses)
 
     def _retrieve(self, options, list_name=None):
         raise NotImplementedError
 
-    def _fetch_url(self, url):
+    def _add_email(self, author, message_id, subject, date,
+                   in_reply_to=None, references=(), patch=False):
+        """
+        Record a mail of author, self.emails is grouped by author as
+        {author: {message-id: mail_threads.Message}}
+        """
+        message = mail_threads.Message(message_id, subject, date,
+                                       in_reply_to, references, patch,
+                                       (self._list_key,))
+        with self._lock:
+            emails = self.emails.setdefault(author, {})
+            new = message_id not in emails
+            emails[message_id] = message
+        if new:
+            self._count(matched=1)
+
+    def _index_message(self, message_id, subject, date, sender,
+                       sender_email, in_reply_to=None, patch=None,
+                       references=()):
+        """
+        Record a message to be stored in the index, if there is one. patch
+        is the patches.Diffstat of the message, if it has a patch.
+        """
+        if self._index is None:
+            return
+        with self._lock:
+            self._index_rows.append((
+                message_id, sender, sender_email, subject,
+                str(date) if date else None, in_reply_to, patch,
+                references))
+
+    def _incomplete(self, months, url):
+        """ Record that months could not be searched because of url """
+        with self._lock:
+            for month in months:
+                self.incomplete.setdefault(month, url)
+
+    def _span(self, kind, name):
+        """ Context manager recording a span of kind in the stats, if any """
+        if self._stats is None:
+            return contextlib.nullcontext()
+        return self._stats.span(self._stats_name, kind, name)
+
+    def _count(self, **counts):
+        """ Add counts to the counters of the stats, if any """
+        if self._stats is not None:
+            self._stats.count(self._stats_name, **counts)
+
+    def _each_month(self, options, retrieve_month):
+        """
+        Call retrieve_month(year, month) for every searched month, at most
+        self._workers months at a time.
+        """
+        workers = min(self._workers, len(options.months))
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=max(1, workers)) as executor:
+            for _ in executor.map(lambda month: retrieve_month(*month),
+                                  options.months):
+                pass
+
+    def _month_over(self, year, month):
+        """ Whether archives of the month will not change any more """
+        last_day = datetime.date(year, month,
+                                 calendar.monthrange(year, month)[1])
+        return (datetime.date.today() - last_day).days > self.grace_days
+
+    def _fetch_url(self, url, immutable=False):
+        """
+        Fetch url, going through the cache if there is one. Pages which
+        never change once published should be fetched with immutable set,
+        they are not revalidated at all once cached.
+        """
+        if self._stats is None:
+            return self._fetch(url, immutable)[0]
+        start = self._stats.now()
+        page, status, retries = self._fetch(url, immutable)
+        if type(page) == tuple:
+            self._stats.fetch(self._stats_name, url, status, start,
+                              self._stats.now() - start, retries=retries)
+            return page
+        return self._stats.measure(self._stats_name, url, status, start,
+                                   page, retries)
+
+    def _fetch(self, url, immutable=False):
+        """
+        Fetch url for _fetch_url, return (page, status, retries) where
+        status tells where the page comes from, e.g. 'cached' or '200'
+        """
+        meta = None
+        headers = {}
+        if self._cache is not None:
+            meta = self._cache.lookup(url)
+            if meta is not None:
+                if self._cache.is_fresh(meta, immutable):
+                    if meta.get('missing'):
+                        return (None, "not_found"), 'cached', 0
+                    cached = self._cache.open(url)
+                    if cached is not None:
+                        return cached, 'cached', 0
+                headers = self._cache.validators(meta)
         if self._debug:
             print("Fetching {}".format(url), file=sys.stderr)
         try:
-            return urllib.request.urlopen(url, timeout=self._timeout)
-        except urllib.error.HTTPError:
-            if self._debug:
-                print("{} is not found".format(url), file=sys.stderr)
-            return (None, "not_found")
-        except urllib.error.URLError:
-            print("{} is not accessable".format(url), file=sys.stderr)
-            return (None, 'unaccessable')
+            response = self._client.open(url, headers, self._timeout)
+        except urllib.error.HTTPError as error:
+            if error.code == 304 and meta is not None:
+                cached = self._cache.open(url, revalidated=True)
+                if cached is not None:
+                    return cached, 'revalidated', 0
+            if error.code in (404, 410):
+                if immutable and self._cache is not None:
+                    self._cache.store_missing(url)
+                if self._debug:
+                    print("{} is not found".format(url), file=sys.stderr)
+                return (None, "not_found"), str(error.code), 0
+            failure = error
+        except urllib.error.URLError as error:
+            failure = error
+        else:
+            status = str(response.status)
+            retries = getattr(response, 'retries', 0)
+            if self._cache is not None:
+                return self._cache.store(url, response, immutable), status, \
+                    retries
+            return response, status, retries
+        # The server could not be reached or failed to answer, even after
+        # the retries of the client
+        status = str(getattr(failure, 'code', 'unreachable'))
+        if meta is not None:
+            print("{0} is not accessable ({1}), using cached copy".format(
+                url, failure.reason), file=sys.stderr)
+            cached = self._cache.open(url)
+            if cached is not None:
+                return cached, 'stale', 0
+        print("{0} is not accessable ({1})".format(url, failure.reason),
+              file=sys.stderr)
+        return (None, 'unaccessable'), status, 0
+
+    def _fetch_content(self, url, immutable=False):
+        """
+        Fetch url and read the whole body, errors are returned as is. A
+        body whose download is cut is fetched once more before giving up.
+        """
+        for attempt in range(2):
+            page = self._fetch_url(url, immutable)
+            if type(page) == tuple:
+                return page
+            try:
+                return page.read()
+            except (OSError, http.client.HTTPException) as error:
+                page.close()
+                failure = error
+        print("{0} could not be read completely ({1})".format(url, failure),
+              file=sys.stderr)
+        return (None, 'unaccessable')
+
+    def _read_chunk(self, url, page, months):
+        """
+        Next chunk of the page of url parsed as it is downloaded, b'' at
+        its end. When the download is cut, the page ends there and months
+        are recorded as incomplete, mails listed before are kept.
+        """
+        try:
+            return page.read1(self.chunk_size)
+        except (OSError, http.client.HTTPException) as error:
+            print("{0} could not be read completely ({1})".format(
+                url, error), file=sys.stderr)
+            self._incomplete(months, url)
+            return b''
+
+    def _fetch_contents(self, urls, immutable=False):
+        """
+        Generator fetching the bodies of urls in parallel, at most
+        self._workers at a time. Bodies are yielded in the order of urls,
+        so callers can stop iterating early and the fetches which have not
+        been started yet are cancelled.
+        """
+        urls = iter(urls)
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self._workers) as executor:
+            pending = collections.deque()
+            try:
+                for url in urls:
+                    pending.append(executor.submit(self._fetch_content, url,
+                                                   immutable))
+                    if len(pending) >= self._workers:
+                        break
+                while pending:
+                    content = pending.popleft().result()
+                    for url in urls:
+                        pending.append(executor.submit(
+                                self._fetch_content, url, immutable))
+                        break
+                    yield content
+            finally:
+                for future in pending:
+                    future.cancel()
 
 
 class LKML(GeneralList):
     """ Class for retrieving from another archiver of LKML """
     url_base = 'http://lkml.iu.edu/hypermail/linux/kernel/'
 
-    def _retrieve(self, options, list_name=None):
-
+    def _author_patterns(self, author):
         # Pattern is like Name &lt;foo@xxxxxxx&gt;
         patterns = []
-        for email in options.email:
+        for email in author.email:
             email_user, email_domain = re.split('@', email)
             patterns.append('{0} &lt;{1}@{2}&gt;'.format(
-                options.name, email_user, 'x' * len(email_domain)))
-        # This archiver stores emails in week-based period
-        week_id = -1
-        first_day = datetime.date(options.year, options.month, 1)
-        if options.month == 12:
-            last_day = datetime.date(options.year+1, 1, 1)
-        else:
-            last_day = datetime.date(options.year, options.month + 1, 1)
+                author.name, email_user, 'x' * len(email_domain)))
+        return patterns
+
+    def _retrieve(self, options, list_name=None):
+        matcher = AuthorMatcher(options.authors, self._author_patterns)
+        # Sections of author.html start with the name of their author
+        names = AuthorMatcher(options.authors, lambda author: [author.name])
+        self._weeks = self._week_index()
+        self._each_month(options, lambda year, month: self._retrieve_month(
+            year, month, matcher, names))
+
+    # Links of the index page to week directories, e.g. href="1608.2/"
+    week_link = re.compile(rb'href=["\']?(?:\./)?(\d{4})\.(\d+)/', re.I)
+
+    def _week_index(self):
+        """
+        Return {'yymm': [week numbers]} of the week directories listed by
+        the index page of the archive, or None if it can not be read
+        """
+        page = self._fetch_content(self.url_base + 'index.html')
+        if type(page) == tuple:
+            return None
+        weeks = {}
+        for month, week in self.week_link.findall(page):
+            weeks.setdefault(month.decode('ascii'), set()).add(int(week))
+        return {month: sorted(numbers) for month, numbers in weeks.items()}
+
+    def _retrieve_month(self, year, month, matcher, names):
+        # This archiver stores emails in week-based period, in directories
+        # yymm.0, yymm.1... listed by the index of the archive
+        prefix = '{0}{1:02}{2:02}'.format(self.url_base, year % 100, month)
+        month_over = self._month_over(year, month)
+        weeks = []
+        if self._weeks is not None:
+            weeks = self._weeks.get(prefix[-4:], [])
+        # The author pages of all the weeks are fetched concurrently
+        urls = ['{0}.{1}/author.html'.format(prefix, week) for week in weeks]
+        for url, page in zip(urls, self._open_weeks(urls, month_over)):
+            if type(page) == tuple:
+                self._incomplete([(year, month)], url)
+                continue
+            self._search_week(url, page, year, month, matcher, names)
+        # A month which is over is complete in the index, unless the index
+        # lists none of its weeks, e.g. because its links could not be read
+        if self._weeks is not None and month_over and weeks:
+            return
+        # Weeks are numbered from 0, the first missing one is past the last
+        # week of the month. Weeks started since the index was cached, or
+        # all of them when the index does not list them, are found this way.
+        week = weeks[-1] + 1 if weeks else 0
         while True:
-            week_id += 1
-            url = '{0}{1}{2}.{3}/author.html'.format(
-                    self.url_base,
-                    options.year % 100,
-                    str(options.month).zfill(2),
-                    week_id)
-            page = self._fetch_url(url)
+            url = '{0}.{1}/author.html'.format(prefix, week)
+            page = self._fetch_url(url, immutable=month_over)
             if type(page) == tuple:
-                if page[1] == 'not_found':
-                    return
-                else:
-                    continue
-            lines = page.readlines()
-            threads = []
-            for index, line in enumerate(lines):
-                if options.name.encode('utf-8') in line:
-                    for index2, line2 in enumerate(lines[index + 1:]):
-                        if re.match(b'<li><strong>.*</strong>$', line2):
-                            threads = lines[index + 1: index + index2 + 1]
-                            break
+                # Later weeks can not be found without this one, so the
+                # month is left incomplete
+                if page[1] != 'not_found':
+                    self._incomplete([(year, month)], url)
+                return
+            self._search_week(url, io.BufferedReader(BackgroundReader(page)),
+                              year, month, matcher, names)
+            week += 1
+
+    def _open_weeks(self, urls, immutable):
+        """
+        Generator of the author pages of urls, in order. They are requested
+        concurrently and read to the end in the background, so later weeks
+        are downloaded while earlier ones are parsed.
+        """
+        def open_week(url):
+            page = self._fetch_url(url, immutable)
+            if type(page) != tuple:
+                page = io.BufferedReader(BackgroundReader(page))
+            return page
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=max(1, min(self._workers, len(urls)))) \
+                as executor:
+            yield from executor.map(open_week, urls)
+
+    def _search_week(self, url, page, year, month, matcher, names):
+        """ Search the author.html page of url, read from the file page """
+        first_day, last_day = month_bounds(year, month)
+        # Detail pages are fetched in parallel, and handled in listing
+        # order
+        details = collections.deque()
+        d_pages = self._fetch_contents(
+                self._week_details(url, page, names, first_day, last_day,
+                                   details),
+                immutable=True)
+        for d_page in d_pages:
+            detail_url, author, subject, date = details.popleft()
+            if type(d_page) != tuple:
+                detail_lines = d_page.decode('utf-8').split("\n")
+            else:
+                if d_page[1] != 'not_found':
+                    self._incomplete([(year, month)], detail_url)
+                continue
+            in_reply_to, references = detail_references(d_page)
+            for line in detail_lines:
+                if 'X-Message-Id:' in line:
+                    m_id_start = len('<!--X-Message-Id: ')
+                    m_id_end = -len(' -->')  # Reversed index
+                    m_id_info = line[m_id_start:m_id_end]
+                    message_id = m_id_info.replace('&#45;', '-')
+                if matcher.match(line) is author:
+                    self._add_email(author, message_id, subject, date,
+                                    in_reply_to, references)
+                    self._index_message(message_id, subject, date,
+                                        author.name, author.email[0].lower(),
+                                        in_reply_to, references=references)
                     break
-            for thread in threads:
-                item = re.split('[<>]', thread.decode('utf-8'))
-                subject, date = item[8], dateparser.parse(item[14]).date()
-                if date < first_day or date >= last_day:
-                    continue
-                detail_url = '{0}{1}'.format(
-                        url[:-len('author.html')],
-                        item[7].split()[-1].split("=")[-1].strip('"'))
-                d_page = self._fetch_url(detail_url)
-                if type(d_page) != tuple:
-                    detail_lines = d_page.read().decode('utf-8').split("\n")
-                else:
-                    continue
-                for line in detail_lines:
-                    if 'X-Message-Id:' in line:
-                        m_id_start = len('<!--X-Message-Id: ')
-                        m_id_end = -len(' -->')  # Reversed index
-                        m_id_info = line[m_id_start:m_id_end]
-                        message_id = m_id_info.replace('&#45;', '-')
-                    if any(match in line for match in patterns):
-                        self.emails[message_id] = (subject, str(date))
-                        break
+
+    def _week_details(self, url, page, names, first_day, last_day, details):
+        """
+        Generator of the urls of the detail pages of the mails of names
+        dated from first_day to last_day, last_day excluded, listed in the
+        author.html page of url. (detail url, author, subject, date) of
+        every url is appended to details before it is yielded.
+        """
+        base = url[:-len('author.html')]
+        for author, thread in self._week_threads(
+                url, page, names, [(first_day.year, first_day.month)]):
+            item = re.split('[<>]', thread.decode('utf-8'))
+            if len(item) <= 14:
+                continue
+            subject, date = item[8], parse_date(item[14])
+            if date is None or date < first_day or date >= last_day:
+                continue
+            detail_url = '{0}{1}'.format(
+                    base, item[7].split()[-1].split("=")[-1].strip('"'))
+            details.append((detail_url, author, subject, date))
+            yield detail_url
+
+    # Sections of author.html start with a line with the name of their
+    # author, followed by a line for every mail
+    section = re.compile(rb'^<li><strong>(.*)</strong>$', re.MULTILINE)
+
+    def _week_threads(self, url, page, names, months):
+        """
+        Yield (author, line) of the mails listed in the author.html page
+        under one of names, as page is downloaded. Only the sections of
+        names are split in lines, the others are skipped by looking for
+        the start of the next section. months are those left incomplete
+        if the download is cut.
+        """
+        author = None
+        scanned = 0
+        rest = b''
+        done = False
+        while not done:
+            chunk = self._read_chunk(url, page, months)
+            done = not chunk
+            threads = []
+            with self._span('parse', url):
+                data = rest + chunk
+                # The last line may be cut, it is parsed with the next chunk
+                end = len(data) if done else data.rfind(b'\n') + 1
+                data, rest = data[:end], data[end:]
+                start = 0
+                headers = 0
+                for header in self.section.finditer(data):
+                    if author is not None:
+                        threads.extend((author, line) for line in
+                                       data[start:header.start()].split(b'\n'))
+                    author = names.match(header.group(1).decode('utf-8',
+                                                                'replace'))
+                    start = header.end()
+                    headers += 1
+                if author is not None:
+                    threads.extend((author, line)
+                                   for line in data[start:].split(b'\n'))
+                scanned += data.count(b'\n<li>') + \
+                    data.startswith(b'<li>') - headers
+            yield from threads
+        self._count(scanned=scanned)
 
 
 class Spinics(GeneralList):
     """ Class for retrieving emails from www.spinics.com """
     url_base = 'http://www.spinics.net/lists/'
     over = False
-    parser = SpinicsHTMLParser()
 
-    def _retrieve(self, options, list_name=None):
+    def _author_patterns(self, author):
         # Pattern is the same as LKML's one
         patterns = []
-        for email in options.email:
+        for email in author.email:
             email_user, email_domain = re.split('@', email)
             patterns.append('{0} <{1}@{2}>'.format(
-                options.name, email_user, 'x' * len(email_domain)))
-        # The range of the dates we want to search
-        first_day = datetime.date(options.year, options.month, 1)
-        if options.month == 12:
-            last_day = datetime.date(options.year+1, 1, 1)
-        else:
-            last_day = datetime.date(options.year, options.month + 1, 1)
-        date_range = (first_day, last_day)
-        # Search for match in the first page
-        first_url = '{0}{1}/maillist.html'.format(self.url_base,
-                                                  list_name,)
-        page = self._fetch_url(first_url)
-        if type(page) != tuple:
-            page = page.read()
-            self._search_in_page(page, list_name, patterns, date_range)
-        elif page[1] == 'not_found':
-            return
+                author.name, email_user, 'x' * len(email_domain)))
+        return patterns
 
-        # Search in the rest ones
-        url_id = 2
-        while True:
-            current_url = '{0}{1}/mail{2}.html'.format(self.url_base,
-                                                       list_name,
-                                                       url_id)
-            page = self._fetch_url(current_url)
-            if type(page) != tuple and not self.over:
-                page = page.read()
-                self._search_in_page(page, list_name, patterns, date_range)
-            else:
+    def _retrieve(self, options, list_name=None):
+        self._listings = {}
+        # Pages are not dated before they are parsed, so a failure leaves
+        # all the searched months incomplete
+        self._months = options.months
+        matcher = AuthorMatcher(options.authors, self._author_patterns)
+        # The range of the dates we want to search, all pages covering it
+        # are walked once
+        date_range = (options.first_day, options.last_day)
+        # Listings are sorted from the newest mail to the oldest, the walk
+        # starts at the first page with mails older than the range end
+        page_map = self._load_page_map(list_name)
+        url_id = self._first_page(list_name, date_range[1], page_map)
+        self._save_page_map(list_name, page_map)
+        while not self.over:
+            current_url = self._page_url(list_name, url_id)
+            # Pages looked at by the search are parsed again from memory,
+            # the others as they are downloaded
+            page = self._listings.pop(url_id, None)
+            if page is None:
+                page = self._fetch_url(current_url)
+                if type(page) != tuple:
+                    page = io.BufferedReader(BackgroundReader(page))
+            elif type(page) != tuple:
+                page = io.BytesIO(page)
+            if type(page) == tuple:
+                if page[1] != 'not_found':
+                    self._incomplete(self._months, current_url)
                 break
+            self._search_in_page(current_url, page, list_name, matcher,
+                                 date_range)
             url_id += 1
 
-    def _search_in_page(self, page, list_name, patterns, date_range):
-        self.parser.feed(page.decode())
-        thread_list = self.parser.thread_list
-        for thread in thread_list:
-            if any([match in thread['email'] for match in patterns]):
-                subject = thread['subject']
-                herf = thread['attrs'][1][1]
-                detail_url = '{0}{1}/{2}'.format(self.url_base,
-                                                 list_name,
-                                                 herf)
-
-                detail_page = self._fetch_url(detail_url)
-                if type(detail_page) != tuple:
-                    detail_lines = detail_page.read().split(b'\n')
-                    message_id, date = None, None
-                    for line in detail_lines:
-                        if b'X-Date:' in line:
-                            d_start = len('<!--X-Date: ')
-                            d_end = -len(' -->')
-                            d_info = line.decode('utf-8')[d_start:d_end]
-                            date = dateparser.parse(d_info.replace('&#45;', '-'))
-                            if date is not None:
-                                date = date.date()
-                                if date < date_range[0]:
-                                    self.over = True
-                                    return
-                        elif b'X-Message-Id:' in line:
-                            m_id_start = len('<!--X-Message-Id: ')
-                            m_id_end = -len(' -->')
-                            message_id = line.decode('utf-8')[m_id_start:m_id_end]
-                            # This HTML pages use &#45 instead of -
-                            message_id = message_id.replace('&#45;', '-')
-                        elif message_id and date and date < date_range[1]:
-                            self.emails[message_id] = (subject, str(date))
+    def _page_url(self, list_name, number):
+        if number == 1:
+            return '{0}{1}/maillist.html'.format(self.url_base, list_name)
+        return '{0}{1}/mail{2}.html'.format(self.url_base, list_name, number)
+
+    def _listing(self, list_name, number):
+        """ Body of a listing page, fetched once per search """
+        if number not in self._listings:
+            self._listings[number] = self._fetch_content(
+                    self._page_url(list_name, number))
+        return self._listings[number]
+
+    def _first_page(self, list_name, last_day, page_map):
+        """
+        Return the number of the first listing page with mails older than
+        last_day. page_map is {page number: date of its oldest mail} from
+        previous searches and is updated with the pages looked at.
+
+        New mails only push older ones to later pages, so a page whose
+        oldest mail was not older than last_day is still not. The search
+        starts after the last such page of the map and gallops forward,
+        then bisects, so a stale map costs a few more pages and an empty
+        one a logarithmic number of them.
+        """
+        def older_than_end(number):
+            date = self._oldest_date(list_name, number)
+            if date is None:
+                # Missing pages are past the last one, and pages which can
+                # not be dated are walked rather than skipped
+                return True
+            page_map[number] = date
+            return date < last_day
+
+        newer = [number for number, date in page_map.items()
+                 if date >= last_day]
+        low = max(newer) if newer else 0
+        high, step = low + 1, 1
+        while not older_than_end(high):
+            low, high = high, high + step
+            step *= 2
+        while high - low > 1:
+            middle = (low + high) // 2
+            if older_than_end(middle):
+                high = middle
+            else:
+                low = middle
+        return high
+
+    def _oldest_date(self, list_name, number):
+        """ Date of the last mail listed on a page, or None """
+        page = self._listing(list_name, number)
+        if type(page) == tuple:
+            return None
+        parser = SpinicsHTMLParser()
+        parser.feed(page.decode('utf-8', 'replace'))
+        parser.close()
+        threads = parser.pop_threads()
+        if not threads:
+            return None
+        href = threads[-1][0]
+        detail_page = self._fetch_content(
+                '{0}{1}/{2}'.format(self.url_base, list_name, href),
+                immutable=True)
+        if type(detail_page) == tuple:
+            return None
+        for line in detail_page.split(b'\n'):
+            if b'X-Date:' in line:
+                return self._detail_date(line)
+        return None
+
+    def _detail_date(self, line):
+        """ Date of the X-Date line of a detail page """
+        d_start = len('<!--X-Date: ')
+        d_end = -len(' -->')
+        d_info = line.decode('utf-8')[d_start:d_end]
+        return parse_date(d_info.replace('&#45;', '-'))
+
+    def _page_map_path(self, list_name):
+        if self._cache is None:
+            return None
+        return os.path.join(self._cache.path, 'spinics',
+                            '{0}.json'.format(list_name))
+
+    def _load_page_map(self, list_name):
+        """ Return the stored {page number: date of its oldest mail} """
+        path = self._page_map_path(list_name)
+        if path is None:
+            return {}
+        try:
+            with open(path) as map_file:
+                stored = json.load(map_file)
+        except (FileNotFoundError, ValueError):
+            return {}
+        if stored.get('url') != self._page_url(list_name, 1):
+            return {}
+        return {int(number): datetime.date.fromisoformat(date)
+                for number, date in stored['oldest'].items()}
+
+    def _save_page_map(self, list_name, page_map):
+        path = self._page_map_path(list_name)
+        if path is None:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(path),
+                                         prefix='.', delete=False) as tmp:
+            json.dump({'url': self._page_url(list_name, 1),
+                       'oldest': {str(number): date.isoformat()
+                                  for number, date in page_map.items()}},
+                      tmp)
+        os.replace(tmp.name, path)
+
+    def _threads(self, url, page):
+        """
+        Yield (href, subject, sender) of the mails listed on the listing
+        page of url, as page is downloaded
+        """
+        parser = SpinicsHTMLParser()
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        scanned = 0
+        done = False
+        while not done:
+            chunk = self._read_chunk(url, page, self._months)
+            done = not chunk
+            with self._span('parse', url):
+                parser.feed(decoder.decode(chunk, final=done))
+                if done:
+                    parser.close()
+            threads = parser.pop_threads()
+            scanned += len(threads)
+            yield from threads
+        self._count(scanned=scanned)
+
+    def _search_in_page(self, url, page, list_name, matcher, date_range):
+        """ Search the listing page of url, read from the file page """
+        matched = collections.deque()
+
+        def detail_urls():
+            for href, subject, sender in self._threads(url, page):
+                author = matcher.match(sender)
+                if author is not None:
+                    detail_url = '{0}{1}/{2}'.format(self.url_base,
+                                                     list_name, href)
+                    matched.append((detail_url, author, subject))
+                    yield detail_url
+        # Detail pages are fetched in parallel while the listing is
+        # downloaded and parsed, but handled in listing order, so stopping
+        # at the first mail older than the range behaves as if they were
+        # fetched one by one
+        detail_pages = self._fetch_contents(detail_urls(), immutable=True)
+        for detail_page in detail_pages:
+            detail_url, author, subject = matched.popleft()
+            if type(detail_page) == tuple:
+                if detail_page[1] != 'not_found':
+                    self._incomplete(self._months, detail_url)
+            else:
+                detail_lines = detail_page.split(b'\n')
+                message_id, date = None, None
+                for line in detail_lines:
+                    if b'X-Date:' in line:
+                        date = self._detail_date(line)
+                        if date is not None and date < date_range[0]:
+                            self.over = True
+                            detail_pages.close()
+                            return
+                    elif b'X-Message-Id:' in line:
+                        m_id_start = len('<!--X-Message-Id: ')
+                        m_id_end = -len(' -->')
+                        message_id = line.decode('utf-8')[m_id_start:m_id_end]
+                        # This HTML pages use &#45 instead of -
+                        message_id = message_id.replace('&#45;', '-')
+                    elif b'X-Head-End' in line:
+                        break
+                if message_id and date and date < date_range[1]:
+                    in_reply_to, references = detail_references(detail_page)
+                    self._add_email(author, message_id, subject, date,
+                                    in_reply_to, references)
+                    self._index_message(message_id, subject, date,
+                                        author.name, author.email[0].lower(),
+                                        in_reply_to, references=references)
 
 class GzipArchived(GeneralList):
     """
-    Base class for lists which provide downloadable gziped archvie files
+    Base class for lists which provide downloadable gziped archvie files.
+
+    When a process pool is given, archives are decompressed in the thread
+    fetching them and cut in pieces of pool_piece_size bytes at message
+    boundaries, which the pool parses in parallel, sending back only the
+    messages of the searched authors.
     """
+    pool_piece_size = 4 * 1024 * 1024
+    # Pieces sent to the pool and not parsed yet, at most
+    pool_window = 8
+    indexes_all_senders = True
+
     def __init__(self, options, url=None, list_name=None, debug=False,
-                 timeout=10):
+                 timeout=10, workers=8, cache=None, index=None, client=None,
+                 stats=None, pool=None):
         if url is not None:
             self.url_base = url
-        super().__init__(options, list_name, debug, timeout)
+        self._pool = pool
+        super().__init__(options, list_name, debug, timeout, workers, cache,
+                         index, client, stats)
 
-    def _beautify_string(self, string):
-        if string is not None:
-            return ' '.join(string.split()).strip("<>")
-        return None
+    def _author_patterns(self, author):
+        # Some archiver stores email address as "foo at bar.com" format
+        # Examples kexec upstream and kexec-fedora
+        return [email for email in author.email] + \
+               [email.replace("@", " at ") for email in author.email]
 
-    def _parse_gz_archive(self, url, options):
+    def _retrieve(self, options, list_name=None):
+        # Archives of all months are fetched and parsed concurrently
+        self._each_month(options, lambda year, month: self._parse_gz_archive(
+            self._archive_url(list_name, year, month), options,
+            self._month_over(year, month), (year, month)))
+
+    def _archive_url(self, list_name, year, month):
+        raise NotImplementedError
+
+    def _parse_gz_archive(self, url, options, immutable=False, month=None):
         """ Method used to parse information from gziped archive """
-        gz_archive = self._fetch_url(url)
-        if type(gz_archive) != tuple:
-            gz_file = gzip.GzipFile(fileobj=io.BytesIO(gz_archive.read()))
-            box = mboxFromFile(gz_file)
-        else:
+        months = [month] if month is not None else options.months
+        gz_archive = self._fetch_url(url, immutable=immutable)
+        if type(gz_archive) == tuple:
+            if gz_archive[1] != 'not_found':
+                self._incomplete(months, url)
             return
-        # Some archiver stores email address as "foo at bar.com" format
-        # Examples kexec upstream and kexec-fedora
-        patterns = [email for email in options.email] + \
-                   [email.replace("@", " at ")
-                    for email in options.email]
-        for message in box:
-            if any(match in message['from'] for match in patterns):
-                subject = self._beautify_string(message['subject'])
-                message_id = self._beautify_string(message['message-id'])
-                in_reply_to = self._beautify_string(message['in-reply-to'])
-                date_info = message['date']
-                lines = message.as_string().split("\n")
-                patch_start = [
-                        start_index for start_index, start_line in
-                        enumerate(lines) if re.match('^--- .*', start_line)]
-                patch_included = False
-                for p_start in patch_start:
-                    if p_start + 2 < len(lines):
-                        s_line = re.match('^\+\+\+ .*',
-                                lines[p_start + 1])
-                        t_line = re.match('^@@ .*',
-                                lines[p_start + 2])
-                        patch_included = \
-                                s_line is not None and \
-                                t_line is not None
-                re_included = re.match('^re:.*|.*\sre:\s.*',
-                                       subject,
-                                       re.IGNORECASE)
-                if in_reply_to and \
-                   not re_included and \
-                   not patch_included:
-                    subject = 'Re: ' + subject
-                date = dateparser.parse(date_info)
-                if date:
-                    date = date.date()
-                self.emails[message_id] = (subject, str(date))
+        # Decompress while downloading, messages are parsed one by one
+        with self._span('parse', url):
+            try:
+                if self._pool is not None:
+                    self._parse_in_pool(gz_archive, options)
+                else:
+                    self._parse_mbox(gzip.GzipFile(fileobj=gz_archive),
+                                     options)
+            except (OSError, EOFError, zlib.error,
+                    http.client.HTTPException) as error:
+                # The download was cut, mails read so far are kept
+                print("{0} could not be read completely ({1})".format(
+                    url, error), file=sys.stderr)
+                self._incomplete(months, url)
+
+    def _parse_mbox(self, mbox_file, options):
+        """ Method used to parse information from an mbox file object """
+        matcher = AuthorMatcher(options.authors, self._author_patterns)
+        # Messages from other people are dropped by only looking at the
+        # bytes of their headers, the rest are parsed completely. All
+        # messages are parsed when they are stored in the index.
+        header_filter = None
+        if self._index is None:
+            header_filter = HeaderFilter(matcher.patterns)
+        box = mboxStream(mbox_file, header_filter)
+        for raw_message in box:
+            message = parse_message(raw_message)
+            if message is not None:
+                self._add_message(matcher, message)
+        self._count(scanned=box.count)
+
+    def _parse_in_pool(self, gz_archive, options):
+        """ Parse the gziped archive file object by the process pool """
+        matcher = AuthorMatcher(options.authors, self._author_patterns)
+        patterns = matcher.patterns if self._index is None else None
+        # zlib does not hold the GIL while decompressing. Pieces are sent
+        # as they are decompressed, pool_window at most at a time, so the
+        # memory used does not grow with the size of the archive.
+        results = collections.deque()
+        for piece in split_mbox(gzip.GzipFile(fileobj=gz_archive),
+                                self.pool_piece_size):
+            results.append(self._pool.submit(parse_mbox_piece, piece,
+                                             patterns))
+            del piece
+            if len(results) >= self.pool_window:
+                self._add_piece(matcher, results.popleft().result())
+        while results:
+            self._add_piece(matcher, results.popleft().result())
+
+    def _add_piece(self, matcher, result):
+        """ Record the messages of a parse_mbox_piece() result """
+        count, messages = result
+        for message in messages:
+            self._add_message(matcher, message)
+        self._count(scanned=count)
+
+    def _add_message(self, matcher, message):
+        """ Record a message returned by parse_message() """
+        sender, message_id, subject, date, in_reply_to, references, patch = \
+            message
+        # Replies are told by the thread of the mail, not its subject
+        author = matcher.match(sender or '')
+        if author is not None:
+            self._add_email(author, message_id, subject, date, in_reply_to,
+                            references, patch is not None)
+        self._index_message(message_id, subject, date, sender,
+                            message_index.sender_address(sender),
+                            in_reply_to, patch, references)
 
 class RHInternal(GzipArchived):
     """ Class for retrieving emails from internal Red Hat lists(deprecated) """
     url_base = 'http://post-office.corp.redhat.com/archives/'
 
-    def _retrieve(self, options, list_name=None):
+    def _archive_url(self, list_name, year, month):
         # RH mailing list archives use full month name
-        month = datetime.date(options.year, options.month, 1).strftime('%B')
-        url = '{0}{1}/{2}-{3}.txt.gz'.format(self.url_base,
-                                             list_name,
-                                             options.year,
-                                             month)
-        self._parse_gz_archive(url, options)
+        month = datetime.date(year, month, 1).strftime('%B')
+        return '{0}{1}/{2}-{3}.txt.gz'.format(self.url_base,
+                                              list_name,
+                                              year,
+                                              month)
 
 
 class Pipermail(GzipArchived):
@@ -314,14 +1194,13 @@ class Pipermail(GzipArchived):
     """
     url_base = 'http://lists.infradead.org/pipermail/'
 
-    def _retrieve(self, options, list_name=None):
+    def _archive_url(self, list_name, year, month):
         # Pipermail uses the same format as RHInternal archiver
-        month = datetime.date(options.year, options.month, 1).strftime('%B')
-        url = '{0}{1}/{2}-{3}.txt.gz'.format(self.url_base,
-                                             list_name,
-                                             options.year,
-                                             month)
-        self._parse_gz_archive(url, options)
+        month = datetime.date(year, month, 1).strftime('%B')
+        return '{0}{1}/{2}-{3}.txt.gz'.format(self.url_base,
+                                              list_name,
+                                              year,
+                                              month)
 
 
 class HyperKitty(GzipArchived):
@@ -330,16 +1209,162 @@ class HyperKitty(GzipArchived):
     """
     url_base = 'https://lists.fedoraproject.org/archives/'
 
-    def _retrieve(self, options, list_name=None):
+    def _archive_url(self, list_name, year, month):
         # Basic method is the same as pipermail and rh-internal
         domain = self.url_base.split('/')[2]
-        month = str(options.month).zfill(2)
-        next_month = str(options.month + 1).zfill(2)
-        url = ("{0}list/{1}@{2}/export/{1}@{2}-{3}-{4}.mbox.gz?"
-               "start={3}-{4}-01&end={3}-{5}-01").format(self.url_base,
-                                                         list_name,
-                                                         domain,
-                                                         options.year,
-                                                         month,
-                                                         next_month)
-        self._parse_gz_archive(url, options)
+        end_year, end_month = next_month(year, month)
+        return ("{0}list/{1}@{2}/export/{1}@{2}-{3}-{4:02}.mbox.gz?"
+                "start={3}-{4:02}-01&end={5}-{6:02}-01").format(self.url_base,
+                                                                list_name,
+                                                                domain,
+                                                                year,
+                                                                month,
+                                                                end_year,
+                                                                end_month)
+
+
+class LocalMbox(GzipArchived):
+    """
+    Class for searching mbox files mirrored to the local disk, plain or
+    gziped, found by the glob pattern given as list name.
+
+    Files are memory-mapped. The first search of a file records where
+    every message starts and ends, its sender and its date in an index
+    stored next to it, as the hidden file .<name>.index, so searches only
+    read the messages of the searched authors and months. Gziped files are
+    decompressed once, next to them as .<name>.mbox. Files which grew
+    since they were indexed, as mirrors of the current month do, are only
+    indexed from their last indexed message.
+    """
+    url_base = 'file://'
+    date_field = re.compile(rb'^date:[ \t]*([^\n]*)', re.IGNORECASE |
+                            re.MULTILINE)
+
+    def _retrieve(self, options, list_name=None):
+        matcher = AuthorMatcher(options.authors, self._author_patterns)
+        paths = sorted(glob.glob(os.path.expanduser(list_name)))
+        if not paths:
+            print("No mbox file matches {0}".format(list_name),
+                  file=sys.stderr)
+        for path in paths:
+            try:
+                self._search_file(path, options, matcher)
+            except OSError as error:
+                print("{0} could not be read ({1})".format(path, error),
+                      file=sys.stderr)
+                self._incomplete(options.months, path)
+
+    def _sidecar(self, path, suffix):
+        directory, name = os.path.split(path)
+        return os.path.join(directory, '.{0}{1}'.format(name, suffix))
+
+    def _search_file(self, path, options, matcher):
+        first_day = options.first_day.toordinal()
+        last_day = options.last_day.toordinal()
+        with self._span('parse', path), \
+                open(self._plain_mbox(path), 'rb') as mbox_file:
+            if os.fstat(mbox_file.fileno()).st_size == 0:
+                return
+            with mmap.mmap(mbox_file.fileno(), 0,
+                           access=mmap.ACCESS_READ) as data:
+                scanned = 0
+                for start, end, sender, day in self._mbox_index(path, data):
+                    if not first_day <= day < last_day:
+                        continue
+                    scanned += 1
+                    # All messages are parsed when they are stored in the
+                    # index
+                    if self._index is None and matcher.match(sender) is None:
+                        continue
+                    # The "From " line is not part of the message
+                    start = data.find(b'\n', start, end) + 1 or end
+                    message = parse_message(data[start:end])
+                    if message is not None:
+                        self._add_message(matcher, message)
+                self._count(scanned=scanned)
+
+    def _plain_mbox(self, path):
+        """ Path of the plain mbox of path, decompressed if needed """
+        if not path.endswith('.gz'):
+            return path
+        plain = self._sidecar(path, '.mbox')
+        try:
+            if os.stat(plain).st_mtime >= os.stat(path).st_mtime:
+                return plain
+        except FileNotFoundError:
+            pass
+        with gzip.open(path) as archive, \
+                tempfile.NamedTemporaryFile(dir=os.path.dirname(plain),
+                                            prefix='.', delete=False) as tmp:
+            try:
+                shutil.copyfileobj(archive, tmp)
+            except BaseException:
+                os.remove(tmp.name)
+                raise
+        os.replace(tmp.name, plain)
+        return plain
+
+    def _mbox_index(self, path, data):
+        """
+        Return [start, end, sender, day number] of every message of data,
+        the mapped mbox of path, read from the index of path when it is up
+        to date
+        """
+        index_path = self._sidecar(path, '.index')
+        stored = None
+        try:
+            with open(index_path) as index_file:
+                stored = json.load(index_file)
+        except (FileNotFoundError, ValueError):
+            pass
+        if stored is not None and stored['size'] == len(data):
+            return stored['messages']
+        messages, start = [], 0
+        if stored is not None and stored['messages'] and \
+           stored['size'] < len(data):
+            # Mirrors append to the files, the last indexed message may
+            # have been cut
+            last = stored['messages'][-1][0]
+            if data[last:last + 5] == b'From ':
+                messages, start = stored['messages'][:-1], last
+        messages.extend(self._scan(data, start))
+        try:
+            with tempfile.NamedTemporaryFile(
+                    'w', dir=os.path.dirname(index_path), prefix='.',
+                    delete=False) as tmp:
+                json.dump({'size': len(data), 'messages': messages}, tmp)
+            os.replace(tmp.name, index_path)
+        except OSError as error:
+            print("{0} could not be saved ({1})".format(index_path, error),
+                  file=sys.stderr)
+        return messages
+
+    def _scan(self, data, start):
+        """ Index the messages of data from the offset start """
+        messages = []
+        if data[start:start + 5] != b'From ':
+            start = data.find(b'\nFrom ', start) + 1 or len(data)
+        while start < len(data):
+            end = data.find(b'\nFrom ', start) + 1 or len(data)
+            headers_end = data.find(b'\n\n', start, end)
+            crlf_end = data.find(b'\n\r\n', start, end)
+            if headers_end < 0 or 0 <= crlf_end < headers_end:
+                headers_end = crlf_end
+            headers = data[start:headers_end if headers_end >= 0 else end]
+            sender = HeaderFilter.from_field.search(headers)
+            sender = ' '.join(sender.group().decode('utf-8', 'replace')
+                              .split()) if sender is not None else ''
+            date = self.date_field.search(headers)
+            date = parse_date(date.group(1).decode('utf-8', 'replace')
+                              .strip()) if date is not None else None
+            # The blank line before the next "From " line is a separator
+            message_end = end
+            tail = data[max(start, end - 4):end]
+            if tail.endswith(b'\r\n\r\n'):
+                message_end -= 2
+            elif tail.endswith(b'\n\n'):
+                message_end -= 1
+            messages.append([start, message_end, sender,
+                             mail_threads.day_number(date)])
+            start = end
+        return messages
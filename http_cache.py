@@ -0,0 +1,214 @@
+""" Persistent on-disk cache of fetched archive pages """
+
+import hashlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+CACHE_DIR = os.path.join(
+        os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+        'list_archive')
+
+
+class _Tee(io.RawIOBase):
+    """
+    Raw reader of body copying what is read to a temporary file in
+    directory. done(path, size) is called with the file once body has been
+    read to the end; the file is removed if body is closed before or can
+    not be read.
+    """
+    def __init__(self, body, directory, done):
+        self._body = body
+        self._done = done
+        self._tmp = tempfile.NamedTemporaryFile(dir=directory, prefix='.',
+                                                delete=False)
+        self.size = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        try:
+            size = self._body.readinto(buffer)
+            if size:
+                self._tmp.write(memoryview(buffer)[:size])
+                self.size += size
+            elif self._tmp is not None:
+                self._tmp.close()
+                tmp, self._tmp = self._tmp, None
+                self._done(tmp.name, self.size)
+        except BaseException:
+            self._discard()
+            raise
+        return size
+
+    def _discard(self):
+        if self._tmp is not None:
+            self._tmp.close()
+            os.remove(self._tmp.name)
+            self._tmp = None
+
+    def close(self):
+        if not self.closed:
+            self._discard()
+            self._body.close()
+        super().close()
+
+
+class HTTPCache(object):
+    """
+    Cache of response bodies keyed by URL.
+
+    Every entry is stored as two files named after the SHA-256 of its URL:
+    the body and a small JSON file with the validators (ETag and
+    Last-Modified) sent back on revalidation. Entries marked immutable,
+    e.g. archives of months which are over, are always served from disk.
+    Other entries are served from disk for `ttl` seconds and revalidated
+    afterwards. When the bodies take more than `max_size` bytes, the least
+    recently used entries are removed. Entries are kept in subdirectories
+    named after the first two digits of their key; other files of the
+    cache directory, e.g. the Spinics page maps, are never evicted.
+    """
+    def __init__(self, path=CACHE_DIR, max_size=512 * 1024 * 1024,
+                 ttl=3600, refresh=False, debug=False):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.refresh = refresh
+        self._debug = debug
+        self._lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._entries())
+
+    def _key(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, key[:2], key)
+
+    def _entries(self):
+        """ Yield (body path, size, last use) of every cached body """
+        for prefix in os.listdir(self.path):
+            directory = os.path.join(self.path, prefix)
+            if len(prefix) != 2 or not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                if name.endswith('.meta') or name.startswith('.'):
+                    continue
+                body = os.path.join(directory, name)
+                try:
+                    stat = os.stat(body)
+                except FileNotFoundError:
+                    continue
+                yield body, stat.st_size, stat.st_mtime
+
+    def lookup(self, url):
+        """ Return the metadata of the entry of url, or None """
+        try:
+            with open(self._key(url) + '.meta') as meta_file:
+                meta = json.load(meta_file)
+        except (FileNotFoundError, ValueError):
+            return None
+        if not os.path.exists(self._key(url)):
+            return None
+        return meta
+
+    def is_fresh(self, meta, immutable=False):
+        """ Whether the entry can be used without asking the server """
+        if self.refresh:
+            return False
+        if immutable or meta.get('immutable'):
+            return True
+        return time.time() - meta.get('stored', 0) < self.ttl
+
+    def validators(self, meta):
+        """ Headers for a conditional request revalidating the entry """
+        headers = {}
+        if meta is None:
+            return headers
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def open(self, url, revalidated=False):
+        """
+        Open the body of the entry of url and mark it as recently used. A
+        revalidated entry is fresh again for another ttl.
+        """
+        body = self._key(url)
+        if revalidated:
+            meta = self.lookup(url)
+            if meta is not None:
+                meta['stored'] = time.time()
+                self._write_meta(url, meta)
+        if self._debug:
+            print("Using cached {}".format(url), file=sys.stderr)
+        try:
+            os.utime(body)
+            return open(body, 'rb')
+        except FileNotFoundError:
+            return None
+
+    def store(self, url, response, immutable=False):
+        """
+        Return the body of response as a file object which saves it for
+        url as it is read. The entry is stored once the body has been read
+        to the end, a body closed before is not stored.
+        """
+        body = self._key(url)
+        os.makedirs(os.path.dirname(body), exist_ok=True)
+        meta = {
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'immutable': immutable,
+        }
+
+        def done(tmp_path, size):
+            try:
+                old_size = os.stat(body).st_size
+            except FileNotFoundError:
+                old_size = 0
+            os.replace(tmp_path, body)
+            meta['stored'] = time.time()
+            self._write_meta(url, meta)
+            with self._lock:
+                self._size += size - old_size
+                if self._size > self.max_size:
+                    self._evict()
+        return io.BufferedReader(
+                _Tee(response, os.path.dirname(body), done),
+                buffer_size=64 * 1024)
+
+    def store_missing(self, url):
+        """ Remember that url of an immutable archive does not exist """
+        body = self._key(url)
+        os.makedirs(os.path.dirname(body), exist_ok=True)
+        open(body, 'wb').close()
+        self._write_meta(url, {'url': url, 'missing': True,
+                               'immutable': True, 'stored': time.time()})
+
+    def _write_meta(self, url, meta):
+        meta_path = self._key(url) + '.meta'
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(meta_path),
+                                         prefix='.', delete=False) as tmp:
+            json.dump(meta, tmp)
+        os.replace(tmp.name, meta_path)
+
+    def _evict(self):
+        """ Remove least recently used entries until under max_size """
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        self._size = sum(size for _, size, _ in entries)
+        for body, size, _ in entries:
+            if self._size <= self.max_size:
+                break
+            for path in (body, body + '.meta'):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self._size -= size
@@ -0,0 +1,194 @@
+""" Pooled HTTP client shared by all list retrievers """
+
+import collections
+import http.client
+import io
+import threading
+import urllib.error
+import urllib.parse
+import zlib
+
+USER_AGENT = 'mail_archive_search'
+
+
+class _Body(io.RawIOBase):
+    """
+    Raw body of a pooled response. The connection goes back to the pool
+    as soon as the body has been read completely, and is dropped if the
+    body is closed before that.
+    """
+    def __init__(self, response, release, compressed=False):
+        self._response = response
+        self._release = release
+        self._decompressor = None
+        if compressed:
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            if self._release is None:
+                return 0
+            data = self._response.read(len(buffer))
+            if not data:
+                self._finish(reuse=True)
+                if self._decompressor is not None:
+                    self._pending = self._decompressor.flush()
+                    self._decompressor = None
+                continue
+            if self._decompressor is not None:
+                data = self._decompressor.decompress(data)
+            self._pending = data
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+    def _finish(self, reuse):
+        if self._release is not None:
+            self._release(reuse and not self._response.will_close)
+            self._release = None
+
+    def close(self):
+        if not self.closed:
+            self._finish(reuse=False)
+        super().close()
+
+
+class Response(io.BufferedReader):
+    """
+    Buffered body of a response with its url, status, headers and the
+    number of times the request was sent again on a new connection
+    """
+    def __init__(self, body, url, status, headers, retries=0):
+        super().__init__(body, buffer_size=64 * 1024)
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.retries = retries
+
+    def __del__(self):
+        # Connections of responses which are not read to the end must
+        # not stay counted against the per-host limit
+        self.close()
+
+
+class HTTPClient(object):
+    """
+    HTTP client keeping connections alive between requests.
+
+    Idle connections are pooled per host and reused by the next request
+    to the same host, so a warm request costs a single round trip. At
+    most `connections` requests are in flight to the same host. Pages are
+    requested with gzip transfer compression when `compress` is set;
+    .gz archives are always transferred as is.
+
+    Errors are reported like urllib.request.urlopen does, with
+    urllib.error.HTTPError and urllib.error.URLError.
+    """
+    max_redirects = 5
+
+    def __init__(self, connections=4, compress=True, timeout=10):
+        self.connections = max(1, connections)
+        self.compress = compress
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle = collections.defaultdict(list)
+        self._slots = {}
+
+    def _slot(self, key):
+        with self._lock:
+            if key not in self._slots:
+                self._slots[key] = threading.BoundedSemaphore(
+                        self.connections)
+            return self._slots[key]
+
+    def _connection(self, key, timeout):
+        """ Return (connection, reused) for key, an idle one if any """
+        with self._lock:
+            if self._idle[key]:
+                connection = self._idle[key].pop()
+                connection.timeout = timeout
+                if connection.sock is not None:
+                    connection.sock.settimeout(timeout)
+                return connection, True
+        return self._new_connection(key, timeout), False
+
+    def _new_connection(self, key, timeout):
+        scheme, host = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, timeout=timeout)
+        return http.client.HTTPConnection(host, timeout=timeout)
+
+    def _release(self, key, connection, slot):
+        def release(reuse):
+            if reuse:
+                with self._lock:
+                    self._idle[key].append(connection)
+            else:
+                connection.close()
+            slot.release()
+        return release
+
+    def open(self, url, headers=None, timeout=None):
+        """ GET url, return a Response which can be read as a file """
+        timeout = timeout if timeout is not None else self.timeout
+        for _ in range(self.max_redirects + 1):
+            response = self._request(url, headers or {}, timeout)
+            if isinstance(response, str):
+                url = response
+                continue
+            return response
+        raise urllib.error.URLError('too many redirects for {}'.format(url))
+
+    def _request(self, url, headers, timeout):
+        """ Return a Response, or the location of a redirection """
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = urllib.parse.urlunsplit(('', '', parts.path or '/',
+                                        parts.query, ''))
+        headers = dict(headers)
+        headers.setdefault('User-Agent', USER_AGENT)
+        compress = self.compress and not parts.path.endswith('.gz')
+        if compress:
+            headers['Accept-Encoding'] = 'gzip'
+        slot = self._slot(key)
+        slot.acquire()
+        retries = 0
+        try:
+            connection, reused = self._connection(key, timeout)
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionError):
+                connection.close()
+                if not reused:
+                    raise
+                # The server closed the idle connection, try a new one
+                retries += 1
+                connection = self._new_connection(key, timeout)
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+        except (OSError, http.client.HTTPException) as error:
+            connection.close()
+            slot.release()
+            raise urllib.error.URLError(error)
+        release = self._release(key, connection, slot)
+        if response.status in (301, 302, 303, 307, 308) and \
+           response.getheader('Location'):
+            response.read()
+            release(not response.will_close)
+            return urllib.parse.urljoin(url, response.getheader('Location'))
+        if response.status >= 300:
+            body = response.read()
+            release(not response.will_close)
+            raise urllib.error.HTTPError(url, response.status,
+                                         response.reason, response.headers,
+                                         io.BytesIO(body))
+        compressed = compress and \
+            response.getheader('Content-Encoding', '').lower() == 'gzip'
+        return Response(_Body(response, release, compressed), url,
+                        response.status, response.headers, retries)
@@ -0,0 +1,273 @@
+""" Threads of messages and their classification into reports """
+
+import datetime
+import re
+import sys
+
+# Prefixes of replies and forwards, possibly repeated or numbered as in
+# "Re[2]:"
+REPLY_PREFIX = re.compile(r'^\s*((re|aw|fwd?)(\[\d+\])?\s*:\s*)+', re.I)
+# [PATCH], [RFC PATCH v2 3/7], [PATCH net-next 0/4]...
+PATCH_TAG = re.compile(
+        r'\[[^\]]*\bPATCH\b(?:[^\]]*?\s0*(\d+)/(\d+))?[^\]]*\]', re.I)
+
+
+def base_subject(subject):
+    """ subject without its reply and forward prefixes """
+    return REPLY_PREFIX.sub('', subject or '').strip()
+
+
+def parse_references(header):
+    """ Tuple of the message ids of a References or In-Reply-To header """
+    return tuple(re.findall(r'<([^<>\s]+)>', header or ''))
+
+
+# Day numbers of dates and tuples of list names, shared by all the
+# messages of a day or of the same lists
+_days = {}
+_lists = {}
+
+
+def day_number(date):
+    """ Proleptic Gregorian ordinal of date, 0 if date is None """
+    if date is None:
+        return 0
+    day = date.toordinal()
+    return _days.setdefault(day, day)
+
+
+def day_date(day):
+    """ datetime.date of a day number, None for 0 """
+    return datetime.date.fromordinal(day) if day else None
+
+
+def _intern(string):
+    return sys.intern(string) if string is not None else None
+
+
+class Message(object):
+    """
+    A mail found in one or several lists. references are the message ids
+    of its ancestors, oldest first, when the archive tells them, and patch
+    is whether it contains a patch.
+
+    Big lists and long periods make many of them, so they are kept small:
+    their date is a day number, their subject is interned, so that the
+    mails of a thread share it, as are message ids, which replies share
+    with the mails they reply to, and mails found in the same lists share
+    the tuple of their names.
+    """
+    __slots__ = ('message_id', 'subject', 'day', 'in_reply_to',
+                 'references', 'patch', 'lists')
+
+    def __init__(self, message_id, subject, date, in_reply_to=None,
+                 references=(), patch=False, lists=()):
+        self.message_id = _intern(message_id)
+        self.subject = sys.intern(subject)
+        self.day = day_number(date)
+        self.in_reply_to = _intern(in_reply_to)
+        self.references = tuple(_intern(reference)
+                                for reference in references)
+        self.patch = patch
+        lists = tuple(lists)
+        self.lists = _lists.setdefault(lists, lists)
+
+    @property
+    def date(self):
+        return day_date(self.day)
+
+    def parents(self):
+        """ Message ids of the ancestors of the message, oldest first """
+        if self.in_reply_to and self.in_reply_to not in self.references:
+            return self.references + (self.in_reply_to,)
+        return self.references
+
+    def merge(self, other):
+        """ Add what other, the same message seen elsewhere, knows more """
+        lists = self.lists + tuple(name for name in other.lists
+                                   if name not in self.lists)
+        self.lists = _lists.setdefault(lists, lists)
+        if len(other.references) > len(self.references):
+            self.references = other.references
+        self.in_reply_to = self.in_reply_to or other.in_reply_to
+        self.patch = self.patch or other.patch
+        self.day = self.day or other.day
+
+
+class Container(object):
+    """ Node of a thread, message is None for mails which were not found """
+    __slots__ = ('message_id', 'message', 'parent', 'children')
+
+    def __init__(self, message_id):
+        self.message_id = message_id
+        self.message = None
+        self.parent = None
+        self.children = []
+
+    def ancestor_of(self, other):
+        """ Whether other is this container or one of its descendants """
+        while other is not None:
+            if other is self:
+                return True
+            other = other.parent
+        return False
+
+    def set_parent(self, parent):
+        if self.parent is not None:
+            self.parent.children.remove(self)
+        self.parent = parent
+        parent.children.append(self)
+
+
+class ThreadSet(object):
+    """
+    Messages of all searched lists, threaded as in Jamie Zawinski's
+    algorithm.
+
+    Messages are deduplicated by Message-ID: a mail cross-posted to several
+    lists is one message which knows all of them. Every message id, found
+    or only referred to, has a container, linked to the container of its
+    parent as told by References and In-Reply-To; links which would make
+    a loop are dropped. Patch series, the patches and their cover letter
+    sent as one thread, are found by walking up these links, and the root
+    of every series is remembered, so classifying all messages takes a
+    time proportional to their number.
+    """
+    def __init__(self):
+        self.messages = {}
+        self.containers = {}
+        self._series_roots = {}
+
+    def _container(self, message_id):
+        container = self.containers.get(message_id)
+        if container is None:
+            container = self.containers[message_id] = Container(message_id)
+        return container
+
+    def add(self, message):
+        """
+        Thread message, return the message kept for its message id, which
+        is an earlier copy of it if it was already added
+        """
+        known = self.messages.get(message.message_id)
+        if known is not None:
+            known.merge(message)
+            if known.parents() == message.parents():
+                return known
+            message = known
+        else:
+            self.messages[message.message_id] = message
+        self._series_roots.clear()
+        container = self._container(message.message_id)
+        container.message = message
+        # Link the references together, as far as they do not contradict
+        # links already known
+        parent = None
+        for message_id in message.parents():
+            reference = self._container(message_id)
+            if parent is not None and reference.parent is None and \
+               not reference.ancestor_of(parent):
+                reference.set_parent(parent)
+            parent = reference
+        # The references of the message itself are authoritative
+        if parent is not None and parent is not container.parent and \
+           not container.ancestor_of(parent):
+            container.set_parent(parent)
+        return message
+
+    def roots(self):
+        """ Containers at the top of the threads """
+        return [container for container in self.containers.values()
+                if container.parent is None]
+
+    def parent(self, message):
+        """ Parent container of message, None if it starts a thread """
+        return self.containers[message.message_id].parent
+
+    def series_root(self, message):
+        """
+        Message id of the first mail of the patch series of message, or None
+        if it is not a patch of a series. Patches of a series are replies to
+        their cover letter, or to the previous patch, without "Re:".
+        """
+        if not self._is_series_mail(message):
+            return None
+        message_id = message.message_id
+        root = self._series_roots.get(message_id)
+        if root is not None:
+            return root
+        path = []
+        container = self.containers[message_id]
+        while True:
+            path.append(container.message_id)
+            parent = container.parent
+            if parent is None or parent.message is None or \
+               not self._is_series_mail(parent.message):
+                root = container.message_id
+                break
+            if parent.message_id in self._series_roots:
+                root = self._series_roots[parent.message_id]
+                break
+            container = parent
+        for message_id in path:
+            self._series_roots[message_id] = root
+        return root
+
+    @staticmethod
+    def _is_series_mail(message):
+        return PATCH_TAG.search(message.subject) is not None and \
+            REPLY_PREFIX.match(message.subject) is None
+
+    def classify(self, message):
+        """
+        Category of message: 'patch', 'cover' for the cover letter of a
+        patch series (numbered 0), 'reply' or 'other'
+        """
+        subject = message.subject
+        if REPLY_PREFIX.match(subject):
+            return 'reply'
+        tag = PATCH_TAG.search(subject)
+        if tag is not None:
+            if tag.group(1) is not None and int(tag.group(1)) == 0:
+                return 'cover'
+            return 'patch'
+        if self.parent(message) is not None:
+            return 'reply'
+        if message.patch:
+            return 'patch'
+        return 'other'
+
+    def report(self, messages):
+        """
+        Group messages, which have been added, into the sections of a
+        report. Return {category: [(count, date, subject)]}, sorted by
+        date, where mails of the same category with the same subject are
+        counted once with the date of the latest, and the number of patch
+        series, a patch sent alone being a series of its own. Replies are
+        shown as "Re: " and the subject they reply to.
+        """
+        groups = {'patch': {}, 'reply': {}, 'other': {}}
+        series = set()
+        for message in messages:
+            category = self.classify(message)
+            subject = message.subject
+            if category == 'reply':
+                subject = 'Re: ' + base_subject(subject)
+            elif category == 'patch':
+                series.add(self.series_root(message) or message.message_id)
+            elif category == 'cover':
+                category = 'other'
+            group = groups[category].get(subject)
+            if group is None:
+                groups[category][subject] = [message.day, 1]
+            else:
+                group[0] = max(group[0], message.day)
+                group[1] += 1
+        report = {}
+        for category, subjects in groups.items():
+            # Mails without date come last
+            entries = sorted(subjects.items(),
+                             key=lambda entry: entry[1][0] or sys.maxsize)
+            report[category] = [(count, day_date(day), subject)
+                                for subject, (day, count) in entries]
+        return report, len(series)
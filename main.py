@@ -2,18 +2,16 @@
 
 """ Main function """
 
-import config_options
-import get_emails
-import re
+import startup
 import sys
 
 
-def print_email(count, date, subject):
+def print_email(count, date, subject, file=sys.stdout):
     if count == 1:
-        print('{0:>8} {1} {2}'.format(' ', date, subject))
+        print('{0:>8} {1} {2}'.format(' ', date, subject), file=file)
     else:
         print('{0:>8} {1} {2}'.format(
-            str(count).join(("[", "]")), date, subject))
+            str(count).join(("[", "]")), date, subject), file=file)
 
 
 def main():
@@ -26,77 +24,228 @@ def main():
     print them.
     """
 
+    startup.profile.enabled = '--profile-startup' in sys.argv[1:]
+    try:
+        run()
+    finally:
+        startup.profile.report()
+
+
+def run():
+    """ Search and print the mails of all configured authors """
     # Parse options from both configuration file and command line
-    options = config_options.Config(sys.argv[1:])
-    if options.email is None or \
-       options.name is None or \
-       options.year is None or \
-       options.month is None:
+    config_options = startup.load('config_options')
+    with startup.step('configuration'):
+        options = config_options.Config(sys.argv[1:])
+    if not options.authors or not options.months:
         return
-    # Start searching
-    searching_email = ' '.join(
-            '<' + email.strip("'") + '>' for email in options.email)
-    print('Searching for {} {}'.format(
-        options.name, searching_email), file=sys.stderr)
-    # Ths dict's structure is {message-id: (subject, date)}
-    emails = {}
+    # Start searching, all authors are searched in a single pass
+    for author in options.authors:
+        print('Searching for {}'.format(author), file=sys.stderr)
+    index = None
+    if options.ingest or options.from_index:
+        message_index = startup.load('message_index')
+        index = message_index.MessageIndex(options.index or
+                                           message_index.INDEX_PATH)
+    run_stats = None
+    if options.stats or options.stats_json or options.trace:
+        run_stats = startup.load('stats').Stats()
+    # Ths dict's structure is {author: {message-id: mail_threads.Message}}
+    if options.from_index:
+        emails = {author: {} for author in options.authors}
+    else:
+        emails = search_lists(options, index, run_stats)
+    if index is not None:
+        # Months already in the index were not fetched again, so the
+        # whole report comes from the index
+        for author in options.authors:
+            emails[author] = index.query(author, options.first_day,
+                                         options.last_day)
+        index.close()
+    # Mails of all authors are threaded together before any is classified
+    threads = startup.load('mail_threads').ThreadSet()
+    for author in options.authors:
+        emails[author] = [threads.add(message)
+                          for message in emails[author].values()]
+    for author in options.authors:
+        if len(options.authors) > 1:
+            print('{}:'.format(author))
+        print_report(emails[author], threads)
+    if run_stats is not None:
+        if options.stats:
+            run_stats.print_table()
+        if options.stats_json:
+            run_stats.write_json(options.stats_json)
+        if options.trace:
+            run_stats.write_trace(options.trace)
+
+
+def search_lists(options, index=None, run_stats=None):
+    """
+    Search all configured lists concurrently, return the mails found as
+    {author: {message-id: mail_threads.Message}}, a mail found in several
+    lists being merged into one. When index is given, all
+    messages of the months missing from it are stored in it. When
+    run_stats is given, the work of every list is recorded in it.
+    """
+    emails = {author: {} for author in options.authors}
+    incomplete = []
+    for name, retriever in run_retrievers(options, index, run_stats):
+        if retriever is None:
+            incomplete.append((name, 'all months', 'the search failed'))
+            continue
+        for author, author_emails in retriever.emails.items():
+            for message_id, message in author_emails.items():
+                known = emails[author].setdefault(message_id, message)
+                if known is not message:
+                    known.merge(message)
+        for (year, month), url in sorted(retriever.incomplete.items()):
+            incomplete.append((name, '{0}-{1:02}'.format(year, month), url))
+    print_incomplete(incomplete)
+    return emails
+
+
+class SearchResources(object):
+    """
+    HTTP cache, client and process pool used by the retrievers. A run
+    creates them once; server.py keeps them for its whole life, so that
+    its searches share the connection limits, the circuit breaker and the
+    cache. close() stops the pool and the replay server.
+    """
+    def __init__(self, options):
+        http_client = startup.load('http_client')
+        self.cache = None
+        if options.cache:
+            http_cache = startup.load('http_cache')
+            self.cache = http_cache.HTTPCache(
+                    options.cache_dir or http_cache.CACHE_DIR,
+                    options.cache_size * 1024 * 1024, options.cache_ttl,
+                    options.refresh, debug=options.debug)
+        client = http_client.HTTPClient(options.connections, options.compress)
+        self._server = None
+        if options.record or options.replay:
+            replay = startup.load('replay')
+            client, self._server = replay.wrap_client(
+                    client, options.record, options.replay, options.debug)
+        retry = startup.load('retry')
+        self.client = retry.RetryingClient(
+                client, options.retries, options.backoff,
+                breaker=retry.CircuitBreaker(options.breaker_failures,
+                                             options.breaker_reset),
+                debug=options.debug)
+        # mbox archives may be parsed by a pool of processes
+        self.pool = None
+        if options.processes > 0 and (options.pipermail or
+                                      options.hyperkitty):
+            futures = startup.load('concurrent.futures')
+            self.pool = futures.ProcessPoolExecutor(options.processes)
+            # Workers are forked by the first task, before the fetching
+            # threads start and could hold locks they would inherit
+            self.pool.submit(int).result()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+        if self._server is not None:
+            self._server.close()
+
+
+def run_retrievers(options, index=None, run_stats=None, resources=None):
+    """
+    Run the retrievers of all configured lists concurrently, return
+    [(list, retriever)] in the order of the configuration, where retriever
+    is None when its search failed. Without resources, SearchResources
+    are created for the run.
+    """
+    if not (options.lkml or options.pipermail or options.hyperkitty or
+            options.spinics or options.localmbox):
+        return []
+    # The retrievers and the HTTP stack are only loaded when some list
+    # has to be searched
+    get_emails = startup.load('get_emails')
+    scheduler = startup.load('scheduler')
+    own_resources = resources is None
+    if own_resources:
+        resources = SearchResources(options)
+    # The time budget is the one of this search
+    retry = startup.load('retry')
+    resources.client.budget = retry.Budget(options.budget) \
+        if options.budget else None
+    settings = {'debug': options.debug, 'timeout': options.timeout,
+                'workers': options.detail_workers, 'cache': resources.cache,
+                'index': index, 'client': resources.client,
+                'stats': run_stats}
+    archive_settings = dict(settings, pool=resources.pool)
+    # Results come back in the order the lists were added
+    fetcher = scheduler.FetchScheduler(options.jobs, options.per_host,
+                                       debug=options.debug)
+    lists = []
     if options.lkml:
-        emails.update(get_emails.LKML(options, "lkml",
-                                      debug=options.debug).emails)
+        fetcher.add(scheduler.url_host(get_emails.LKML.url_base),
+                    get_emails.LKML, options, "lkml", **settings)
+        lists.append('lkml')
     for url, mailing_lists in options.pipermail.items():
         for mailing_list in mailing_lists:
-            emails.update(get_emails.Pipermail(
-                options, url, mailing_list, debug=options.debug).emails)
+            fetcher.add(scheduler.url_host(url), get_emails.Pipermail,
+                        options, url, mailing_list, **archive_settings)
+            lists.append('{0}{1}'.format(url, mailing_list))
     for url, mailing_lists in options.hyperkitty.items():
         for mailing_list in mailing_lists:
-            emails.update(get_emails.HyperKitty(
-                options, url, mailing_list, debug=options.debug).emails)
+            fetcher.add(scheduler.url_host(url), get_emails.HyperKitty,
+                        options, url, mailing_list, **archive_settings)
+            lists.append('{0}{1}'.format(url, mailing_list))
     for mailing_list in options.spinics:
-        emails.update(get_emails.Spinics(
-            options, mailing_list, debug=options.debug).emails)
-    emails = [info for message_id, info in emails.items()]
-    patched, replied, others = [], [], []
-    patched_count, replied_count, others_count = 0, 0, 0
-    # Count emails which have the same subject
-    filtered_emails = {}
-    for subject, date in emails:
-        if subject in filtered_emails:
-            if date > filtered_emails[subject][0]:
-                filtered_emails[subject][0] = date
-            filtered_emails[subject][1] += 1
-        else:
-            filtered_emails[subject] = [date, 1]
-    filtered_emails = [
-            (count, date, subject) for subject, (date, count) in
-            filtered_emails.items()]
-    filtered_emails.sort(key=lambda tup: tup[1])
-    # Output result
-    for count, date, subject in filtered_emails:
-        if re.match('^re:.*|.*\sre:\s.*', subject, re.IGNORECASE):
-            replied.append((count, date, subject))
-            replied_count += count
-        elif re.match('.*\Wpatch\W.*', subject, re.IGNORECASE):
-            if re.match('.*\s0+\/\d.*', subject, re.IGNORECASE):
-                others.append((count, date, subject))
-                others_count += count
-            else:
-                patched.append((count, date, subject))
-                patched_count += count
-        else:
-            others.append((count, date, subject))
-            others_count += count
-    print('Patches:')
-    for count, date, subject in patched:
-        print_email(count, date, subject)
-    print('Replied:')
-    for count, date, subject in replied:
-        print_email(count, date, subject)
-    print('Others:')
-    for count, date, subject in others:
-        print_email(count, date, subject)
-    print("{} meesages found, {} patches, {} replied, {} others".format(
-                        len(emails), patched_count,
-                        replied_count, others_count))
+        fetcher.add(scheduler.url_host(get_emails.Spinics.url_base),
+                    get_emails.Spinics, options, mailing_list, **settings)
+        lists.append('{0}{1}'.format(get_emails.Spinics.url_base,
+                                     mailing_list))
+    # Local files are read by one list at a time, as if they were on the
+    # same host
+    fetcher.limit('localhost', 1)
+    for path in options.localmbox:
+        fetcher.add('localhost', get_emails.LocalMbox, options, None, path,
+                    **settings)
+        lists.append(path)
+    try:
+        with startup.step('search'):
+            retrievers = fetcher.run()
+    finally:
+        if own_resources:
+            resources.close()
+    return list(zip(lists, retrievers))
+
+
+def print_incomplete(incomplete, file=sys.stderr):
+    """ Print (list, month, reason) of the months not searched completely """
+    if not incomplete:
+        return
+    print('Incomplete results, these lists could not be searched '
+          'completely:', file=file)
+    for name, month, reason in incomplete:
+        print('    {0} {1}: {2}'.format(name, month, reason), file=file)
+
+
+def print_report(messages, threads, file=sys.stdout):
+    """
+    Print messages by category, threads is the mail_threads.ThreadSet
+    they were added to
+    """
+    report, series = threads.report(messages)
+    counts = {category: sum(count for count, date, subject in entries)
+              for category, entries in report.items()}
+    print('Patches:', file=file)
+    for count, date, subject in report['patch']:
+        print_email(count, date, subject, file)
+    print('Replied:', file=file)
+    for count, date, subject in report['reply']:
+        print_email(count, date, subject, file)
+    print('Others:', file=file)
+    for count, date, subject in report['other']:
+        print_email(count, date, subject, file)
+    print("{} meesages found, {} patches in {} series, {} replied, "
+          "{} others".format(len(messages), counts['patch'], series,
+                             counts['reply'], counts['other']), file=file)
+
 
 if __name__ == '__main__':
     main()
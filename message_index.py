@@ -0,0 +1,178 @@
+""" Local SQLite index of archived messages """
+
+import datetime
+import email.utils
+import os
+import threading
+import time
+
+import mail_threads
+
+INDEX_PATH = os.path.expanduser("~/.list_archive.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    message_id TEXT NOT NULL,
+    list TEXT NOT NULL,
+    sender TEXT,
+    sender_email TEXT,
+    subject TEXT,
+    date TEXT,
+    in_reply_to TEXT,
+    patch INTEGER NOT NULL DEFAULT 0,
+    files INTEGER,
+    added INTEGER,
+    removed INTEGER,
+    refs TEXT,
+    PRIMARY KEY (message_id, list)
+);
+CREATE INDEX IF NOT EXISTS messages_sender ON messages (sender_email, date);
+CREATE INDEX IF NOT EXISTS messages_date ON messages (date);
+CREATE TABLE IF NOT EXISTS months (
+    list TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    complete INTEGER NOT NULL,
+    ingested REAL NOT NULL,
+    PRIMARY KEY (list, year, month)
+);
+CREATE TABLE IF NOT EXISTS author_months (
+    list TEXT NOT NULL,
+    address TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    complete INTEGER NOT NULL,
+    ingested REAL NOT NULL,
+    PRIMARY KEY (list, address, year, month)
+);
+"""
+
+
+def sender_address(sender):
+    """ Normalized email address of a From header, or None """
+    if not sender:
+        return None
+    # Some archivers store addresses as "foo at bar.com (Foo)"
+    if '<' not in sender:
+        sender = sender.replace(' at ', '@')
+    address = email.utils.parseaddr(sender)[1]
+    return address.lower() if '@' in address else None
+
+
+class MessageIndex(object):
+    """
+    Index of messages of all configured lists.
+
+    Messages are stored per list, so a message cross-posted to several
+    lists has one row per list. Every (list, month) which has been
+    ingested is recorded; months which are over are marked complete and
+    never ingested again. Lists of which only the mails of the searched
+    people are stored record their months per (list, address, month)
+    instead, so searching other people ingests the month again.
+    """
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        # Only runs using the index pay for loading sqlite3
+        import sqlite3
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.executescript(SCHEMA)
+            # Diffstat and references columns were added after the first
+            # version
+            columns = [row[1] for row in
+                       self._db.execute("PRAGMA table_info(messages)")]
+            for column, kind in (('files', 'INTEGER'), ('added', 'INTEGER'),
+                                 ('removed', 'INTEGER'), ('refs', 'TEXT')):
+                if column not in columns:
+                    self._db.execute("ALTER TABLE messages ADD COLUMN "
+                                     "{0} {1}".format(column, kind))
+
+    def close(self):
+        self._db.close()
+
+    def complete_months(self, list_key, addresses=None):
+        """
+        Set of (year, month) of list_key which need no ingesting, for all
+        of addresses when they are given
+        """
+        with self._lock:
+            if addresses is None:
+                rows = self._db.execute(
+                    "SELECT year, month FROM months "
+                    "WHERE list = ? AND complete", (list_key,)).fetchall()
+            else:
+                addresses = sorted(set(addresses))
+                rows = self._db.execute(
+                    "SELECT year, month FROM author_months "
+                    "WHERE list = ? AND complete AND address IN ({0}) "
+                    "GROUP BY year, month HAVING COUNT(*) = ?".format(
+                        ', '.join('?' * len(addresses))),
+                    [list_key] + addresses + [len(addresses)]).fetchall()
+        return set(rows)
+
+    def add(self, list_key, messages, months, addresses=None):
+        """
+        Store messages of list_key, as (message_id, sender, sender_email,
+        subject, date, in_reply_to, diffstat, references) tuples where
+        diffstat is None for messages without patch, and record months as
+        ingested, for each of addresses when they are given. months is a
+        list of ((year, month), complete).
+        """
+        now = time.time()
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO messages (message_id, list, sender, "
+                "sender_email, subject, date, in_reply_to, patch, files, "
+                "added, removed, refs) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                ((message_id, list_key, sender, sender_email, subject, date,
+                  in_reply_to, int(stat is not None),
+                  len(stat.files) if stat else None,
+                  stat.added if stat else None,
+                  stat.removed if stat else None,
+                  ' '.join(references) or None)
+                 for message_id, sender, sender_email, subject, date,
+                 in_reply_to, stat, references in messages))
+            if addresses is None:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO months (list, year, month, "
+                    "complete, ingested) VALUES (?, ?, ?, ?, ?)",
+                    ((list_key, year, month, int(complete), now)
+                     for (year, month), complete in months))
+            else:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO author_months (list, address, "
+                    "year, month, complete, ingested) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    ((list_key, address, year, month, int(complete), now)
+                     for (year, month), complete in months
+                     for address in set(addresses)))
+
+    def query(self, author, first_day, last_day):
+        """
+        Return {message-id: mail_threads.Message} of the mails of author
+        dated from first_day to last_day, last_day excluded. A mail stored
+        for several lists is returned once.
+        """
+        addresses = [address.lower() for address in author.email]
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT message_id, subject, date, in_reply_to, refs, "
+                "patch, list FROM messages "
+                "WHERE sender_email IN ({0}) AND date >= ? AND date < ? "
+                "ORDER BY list".format(', '.join('?' * len(addresses))),
+                addresses + [first_day.isoformat(),
+                             last_day.isoformat()]).fetchall()
+        messages = {}
+        for message_id, subject, date, in_reply_to, refs, patch, list_key \
+                in rows:
+            message = mail_threads.Message(
+                    message_id, subject, datetime.date.fromisoformat(date),
+                    in_reply_to, (refs or '').split(), bool(patch),
+                    (list_key,))
+            if message_id in messages:
+                messages[message_id].merge(message)
+            else:
+                messages[message_id] = message
+        return messages
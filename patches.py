@@ -0,0 +1,72 @@
+""" Detection of patches in message bodies """
+
+import re
+
+# A patch starts with a ---/+++ file header followed by a hunk header
+PATCH_START = re.compile(r'^--- [^\n]*\n\+\+\+ [^\n]*\n@@ ', re.MULTILINE)
+HUNK_HEADER = re.compile(r'@@ -\d+(?:,(\d+))? \+\d+(?:,(\d+))? @@')
+
+
+class Diffstat(object):
+    """ Files touched and lines added and removed by a patch """
+    __slots__ = ('files', 'added', 'removed')
+
+    def __init__(self, files=None, added=0, removed=0):
+        self.files = files if files is not None else []
+        self.added = added
+        self.removed = removed
+
+    def __repr__(self):
+        return '{0} files changed, {1} insertions(+), {2} deletions(-)'.format(
+            len(self.files), self.added, self.removed)
+
+
+def diffstat(body):
+    """
+    Return the Diffstat of the patches in body, or None if there is no
+    patch. Lines are counted from the hunk headers, so text around the
+    patches, e.g. a "-- " signature, is not counted.
+    """
+    start = PATCH_START.search(body)
+    if start is None:
+        return None
+    stat = Diffstat()
+    lines = body[start.start():].split('\n')
+    index = 0
+    while index < len(lines):
+        line = lines[index]
+        if line.startswith('--- ') and index + 2 < len(lines) and \
+           lines[index + 1].startswith('+++ ') and \
+           lines[index + 2].startswith('@@ '):
+            stat.files.append(_file_name(line, lines[index + 1]))
+            index += 2
+            continue
+        hunk = HUNK_HEADER.match(line)
+        index += 1
+        if hunk is None:
+            continue
+        old = int(hunk.group(1) or 1)
+        new = int(hunk.group(2) or 1)
+        while (old > 0 or new > 0) and index < len(lines):
+            line = lines[index]
+            if line.startswith('+'):
+                stat.added += 1
+                new -= 1
+            elif line.startswith('-'):
+                stat.removed += 1
+                old -= 1
+            elif not line.startswith('\\'):
+                old -= 1
+                new -= 1
+            index += 1
+    return stat
+
+
+def _file_name(old_header, new_header):
+    """ Name of the file of a ---/+++ header, without the a/ b/ prefix """
+    name = new_header[4:].split('\t')[0].strip()
+    if name == '/dev/null':
+        name = old_header[4:].split('\t')[0].strip()
+    if name.startswith(('a/', 'b/')):
+        name = name[2:]
+    return name
@@ -0,0 +1,264 @@
+#!/usr/bin/python3
+
+""" Recording of archive responses and their replay by a local server """
+
+import argparse
+import gzip
+import hashlib
+import http.server
+import io
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import urllib.error
+import urllib.parse
+
+import http_client
+
+# Headers about the transfer rather than the page, the server replaying a
+# response sends its own
+TRANSFER_HEADERS = {'connection', 'content-encoding', 'content-length',
+                    'keep-alive', 'transfer-encoding'}
+
+
+class Recording(object):
+    """
+    Directory of recorded responses.
+
+    Every response is stored as two files named after the SHA-256 of its
+    URL: the decoded body and a JSON file with the URL, the status and the
+    headers. Responses of all hosts share the directory.
+    """
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+
+    def _key(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, key)
+
+    def lookup(self, url):
+        """ Return the metadata of the response of url, or None """
+        try:
+            with open(self._key(url) + '.json') as meta_file:
+                return json.load(meta_file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def body(self, url):
+        """ Path of the recorded body of url """
+        return self._key(url)
+
+    def store(self, url, status, headers, body):
+        """
+        Record the response of url, headers is a list of (name, value)
+        and body a file object. Return the path of the stored body.
+        """
+        path = self._key(url)
+        with tempfile.NamedTemporaryFile(dir=self.path, prefix='.',
+                                         delete=False) as tmp:
+            try:
+                shutil.copyfileobj(body, tmp)
+            except BaseException:
+                os.remove(tmp.name)
+                raise
+        os.replace(tmp.name, path)
+        with tempfile.NamedTemporaryFile('w', dir=self.path, prefix='.',
+                                         delete=False) as tmp:
+            json.dump({'url': url, 'status': status,
+                       'headers': [[name, value] for name, value in headers
+                                   if name.lower() not in TRANSFER_HEADERS]},
+                      tmp)
+        os.replace(tmp.name, path + '.json')
+        return path
+
+
+class Recorder(object):
+    """ HTTP client recording every response of client to path """
+    def __init__(self, client, path):
+        self._client = client
+        self.recording = Recording(path)
+
+    def open(self, url, headers=None, timeout=None):
+        try:
+            response = self._client.open(url, headers, timeout)
+        except urllib.error.HTTPError as error:
+            # Answers to conditional requests say nothing about the page
+            if error.code != 304:
+                self.recording.store(url, error.code, error.headers.items(),
+                                     error)
+            raise
+        body = self.recording.store(url, response.status,
+                                    response.headers.items(), response)
+        return http_client.Response(io.FileIO(body), url, response.status,
+                                    response.headers)
+
+
+class ReplayClient(object):
+    """ HTTP client asking a ReplayServer at server_url for every url """
+    def __init__(self, client, server_url):
+        self._client = client
+        self.server_url = server_url.rstrip('/') + '/'
+
+    def open(self, url, headers=None, timeout=None):
+        response = self._client.open(replay_url(self.server_url, url),
+                                     headers, timeout)
+        response.url = url
+        return response
+
+
+def replay_url(server_url, url):
+    """ URL of the replay of url, e.g. <server_url>/https/host/path """
+    return server_url + url.replace('://', '/', 1)
+
+
+class _ReplayHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        # Headers and body are written separately, without this every
+        # response of a kept alive connection waits for a delayed ACK
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY,
+                                   1)
+
+    def do_GET(self):
+        replay = self.server.replay
+        scheme, _, rest = self.path.lstrip('/').partition('/')
+        url = '{0}://{1}'.format(scheme, rest)
+        meta = replay.recording.lookup(url)
+        if meta is None:
+            if replay.debug:
+                print("{} was not recorded".format(url), file=sys.stderr)
+            self._send(404, [], b'')
+            return
+        headers = meta['headers']
+        etag = [value for name, value in headers if name.lower() == 'etag']
+        if etag and self.headers.get('If-None-Match') == etag[0]:
+            self._send(304, headers, b'')
+            return
+        with open(replay.recording.body(url), 'rb') as body_file:
+            body = body_file.read()
+        encoding = None
+        path = urllib.parse.urlsplit(url).path
+        if body and 'gzip' in self.headers.get('Accept-Encoding', '') and \
+           not path.endswith('.gz'):
+            body = gzip.compress(body)
+            encoding = 'gzip'
+        self._send(meta['status'], headers, body, encoding)
+
+    def _send(self, status, headers, body, encoding=None):
+        self.send_response(status)
+        for name, value in headers:
+            if name.lower() not in TRANSFER_HEADERS:
+                self.send_header(name, value)
+        if encoding is not None:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.replay.count(len(body))
+
+    def log_message(self, format, *args):
+        if self.server.replay.debug:
+            super().log_message(format, *args)
+
+
+class ReplayServer(object):
+    """
+    Local HTTP server answering with the responses recorded in path, as
+    asked by a ReplayClient. Pages are sent gzip compressed when the
+    client accepts it, like archive servers do. The requests served and
+    the bytes of the bodies sent are counted.
+    """
+    def __init__(self, path, host='127.0.0.1', port=0, debug=False):
+        self.recording = Recording(path)
+        self.debug = debug
+        self.requests = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._server = http.server.ThreadingHTTPServer((host, port),
+                                                       _ReplayHandler)
+        self._server.daemon_threads = True
+        self._server.replay = self
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://{0}:{1}/'.format(*self._server.server_address[:2])
+
+    def count(self, size):
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += size
+
+    def reset(self):
+        """ Reset the counters, return their values """
+        with self._lock:
+            counters = self.requests, self.bytes_sent
+            self.requests, self.bytes_sent = 0, 0
+        return counters
+
+    def start(self):
+        """ Serve in a background thread """
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def close(self):
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+        self._server.server_close()
+
+
+def wrap_client(client, record=None, replay=None, debug=False):
+    """
+    Return (client, server) where client records its responses to the
+    directory record, or replays them from replay, which is either a
+    recording directory or the URL of a running replay server. server is
+    the ReplayServer started for a directory, to be closed by the caller,
+    or None.
+    """
+    if record:
+        return Recorder(client, record), None
+    if not replay:
+        return client, None
+    if os.path.isdir(replay):
+        server = ReplayServer(replay, debug=debug)
+        server.start()
+        return ReplayClient(client, server.url), server
+    return ReplayClient(client, replay), None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description='Serve recorded archive responses, searches are '
+                        'replayed with main.py --replay URL')
+    parser.add_argument('recording', help='directory of a --record run')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('-d', '--debug', action='store_true')
+    args = parser.parse_args()
+    server = ReplayServer(args.recording, args.host, args.port, args.debug)
+    print('Replaying {0} at {1}'.format(args.recording, server.url),
+          file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        print('{0} requests, {1} bytes sent'.format(
+            server.requests, server.bytes_sent), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
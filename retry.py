@@ -0,0 +1,137 @@
+""" Retries, time budget and circuit breaking of archive requests """
+
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+
+
+class Budget(object):
+    """ Wall-clock time left to a run of `seconds` started at creation """
+    def __init__(self, seconds):
+        self.deadline = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0, self.deadline - time.monotonic())
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker of every host.
+
+    After `failures` consecutive failed attempts to reach a host, its
+    circuit opens and requests to it fail at once, instead of each of
+    them waiting for the timeout. After `reset` seconds, a single request
+    is let through: the circuit closes again if it succeeds.
+    """
+    def __init__(self, failures=10, reset=60):
+        self.failures = failures
+        self.reset = reset
+        self._lock = threading.Lock()
+        # host: [consecutive failures, time the circuit opened, probing]
+        self._hosts = {}
+
+    def allow(self, host):
+        """ Whether a request to host may be sent """
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None or state[0] < self.failures:
+                return True
+            if not state[2] and time.monotonic() - state[1] >= self.reset:
+                state[2] = True
+                return True
+            return False
+
+    def success(self, host):
+        with self._lock:
+            self._hosts.pop(host, None)
+
+    def failure(self, host):
+        with self._lock:
+            state = self._hosts.setdefault(host, [0, 0, False])
+            state[0] += 1
+            if state[0] >= self.failures:
+                state[1] = time.monotonic()
+                state[2] = False
+
+
+class RetryingClient(object):
+    """
+    HTTP client sending requests of client again when they fail.
+
+    Connection errors, timeouts and answers telling that the server is
+    busy or broken are retried up to `retries` times, after exponential
+    backoff delays with full jitter: a random delay between 0 and
+    backoff * 2 ** attempt seconds, at most max_backoff. Requests are
+    not sent when their host's circuit is open in breaker, and their
+    timeout is cut to the time left in budget, so that no list can make
+    a run last longer than the budget.
+    """
+    retry_codes = (408, 429, 500, 502, 503, 504)
+
+    def __init__(self, client, retries=3, backoff=0.5, max_backoff=30,
+                 budget=None, breaker=None, debug=False):
+        self._client = client
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.budget = budget
+        self.breaker = breaker
+        self._debug = debug
+
+    def open(self, url, headers=None, timeout=None):
+        host = urllib.parse.urlsplit(url).netloc
+        attempt = 0
+        while True:
+            if self.breaker is not None and not self.breaker.allow(host):
+                raise urllib.error.URLError(
+                        'circuit open for {}'.format(host))
+            if self.budget is not None:
+                remaining = self.budget.remaining()
+                if remaining <= 0:
+                    raise urllib.error.URLError('time budget exhausted')
+                timeout = remaining if timeout is None else \
+                    min(timeout, remaining)
+            try:
+                response = self._client.open(url, headers, timeout)
+            except urllib.error.HTTPError as error:
+                if error.code not in self.retry_codes:
+                    # The server answered, e.g. not found or not modified
+                    self._success(host)
+                    raise
+                failure = error
+            except urllib.error.URLError as error:
+                failure = error
+            else:
+                self._success(host)
+                response.retries = getattr(response, 'retries', 0) + attempt
+                return response
+            if self.breaker is not None:
+                self.breaker.failure(host)
+            if attempt >= self.retries:
+                raise failure
+            delay = self._delay(attempt, failure)
+            if self.budget is not None and \
+               delay >= self.budget.remaining():
+                raise failure
+            if self._debug:
+                print("Retrying {0} in {1:.1f} s: {2}".format(
+                    url, delay, failure), file=sys.stderr)
+            time.sleep(delay)
+            attempt += 1
+
+    def _success(self, host):
+        if self.breaker is not None:
+            self.breaker.success(host)
+
+    def _delay(self, attempt, failure):
+        delay = random.uniform(0, min(self.max_backoff,
+                                      self.backoff * 2 ** attempt))
+        # Busy servers may tell when to come back
+        retry_after = getattr(failure, 'headers', None) and \
+            failure.headers.get('Retry-After')
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(self.max_backoff, int(retry_after)))
+        return delay
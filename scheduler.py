@@ -0,0 +1,81 @@
+""" Concurrent scheduling of list retrievers """
+
+import collections
+import concurrent.futures
+import sys
+import traceback
+import urllib.parse
+
+
+def url_host(url):
+    """ Return the host part of url, used as the per-host limit key """
+    return urllib.parse.urlsplit(url).netloc
+
+
+class FetchScheduler(object):
+    """
+    Run list retrievers concurrently.
+
+    At most `jobs` retrievers run at the same time, and at most `per_host`
+    of them talk to the same host (0 means no per-host limit), unless
+    limit() sets another limit for the host. Results are
+    returned in the order the retrievers were added, so merging them gives
+    the same result as running them one after another.
+    """
+    def __init__(self, jobs=4, per_host=2, debug=False):
+        self.jobs = max(1, jobs)
+        self.per_host = per_host
+        self._debug = debug
+        self._tasks = []
+        self._limits = {}
+
+    def limit(self, host, count):
+        """ Let at most count retrievers talk to host at the same time """
+        self._limits[host] = count
+
+    def add(self, host, retriever, *args, **kwargs):
+        """ Queue retriever(*args, **kwargs) which fetches from host """
+        self._tasks.append((host, retriever, args, kwargs))
+
+    def _host_free(self, active, host):
+        limit = self._limits.get(host, self.per_host)
+        return limit <= 0 or active[host] < limit
+
+    def run(self):
+        """
+        Run all queued retrievers, return their results in queued order.
+        A retriever which raises is reported and its result is None.
+        """
+        results = [None] * len(self._tasks)
+        pending = collections.deque(enumerate(self._tasks))
+        running = {}
+        active = collections.Counter()
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.jobs) as executor:
+            while pending or running:
+                deferred = collections.deque()
+                while pending and len(running) < self.jobs:
+                    index, (host, retriever, args, kwargs) = pending.popleft()
+                    if not self._host_free(active, host):
+                        deferred.append((index, (host, retriever,
+                                                 args, kwargs)))
+                        continue
+                    active[host] += 1
+                    future = executor.submit(retriever, *args, **kwargs)
+                    running[future] = (index, host)
+                deferred.extend(pending)
+                pending = deferred
+                done, _ = concurrent.futures.wait(
+                        running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    index, host = running.pop(future)
+                    active[host] -= 1
+                    try:
+                        results[index] = future.result()
+                    except Exception:
+                        print("Retrieving from {} failed".format(host),
+                              file=sys.stderr)
+                        if self._debug:
+                            traceback.print_exc()
+        self._tasks = []
+        return results
@@ -0,0 +1,409 @@
+#!/usr/bin/python3
+
+""" Service answering report queries from mails kept in memory """
+
+import argparse
+import collections
+import datetime
+import http.server
+import io
+import json
+import os
+import socketserver
+import sys
+import threading
+import time
+import urllib.parse
+
+import config_options
+import dates
+import get_emails
+import mail_threads
+import main as report
+
+
+def month_over(year, month):
+    """ Whether archives of the month will not change any more """
+    # The rule of the retrievers, their archives get late mails for a few
+    # days after the month
+    next_first = dates.month_bounds(year, month)[1]
+    return (datetime.date.today() - next_first).days >= \
+        get_emails.GeneralList.grace_days
+
+
+def consecutive_runs(months):
+    """ Split sorted (year, month) into lists of consecutive months """
+    runs = []
+    for month in months:
+        if runs and dates.next_month(*runs[-1][-1]) == month:
+            runs[-1].append(month)
+        else:
+            runs.append([month])
+    return runs
+
+
+class MonthCache(object):
+    """
+    Least recently used months, at most size of them. Every month is
+    {'emails': {author: {message-id: mail_threads.Message}}, 'incomplete':
+    [(list, reason)], 'searched': time}, mails of all lists being merged.
+    """
+    def __init__(self, size):
+        self.size = size
+        self._months = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, month):
+        with self._lock:
+            entry = self._months.get(month)
+            if entry is not None:
+                self._months.move_to_end(month)
+            return entry
+
+    def put(self, month, entry):
+        with self._lock:
+            self._months[month] = entry
+            self._months.move_to_end(month)
+            while len(self._months) > self.size:
+                self._months.popitem(last=False)
+
+    def months(self):
+        with self._lock:
+            return list(self._months)
+
+
+class ReportService(object):
+    """
+    Reports of the configured authors, from the mails of every month
+    searched once and kept in a MonthCache.
+
+    Months missing from the cache are searched when a query needs them,
+    every run of consecutive ones in one pass over the lists as main.py
+    searches a range, and the mails found are split into months by their
+    date. All searches
+    share the SearchResources of the service, so they share its HTTP
+    connections, circuit breaker, cache and process pool. Months which are
+    not over, or whose search was incomplete, are searched again every
+    refresh seconds in the background.
+    """
+    def __init__(self, options, size=60, refresh=600):
+        self.options = options
+        self.cache = MonthCache(size)
+        self.refresh = refresh
+        # Created before any thread starts, the process pool forks then
+        self.resources = report.SearchResources(options)
+        # Searches are run one after another, queries of cached months
+        # do not wait for them
+        self._search_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def authors(self, wanted):
+        """
+        Configured authors whose name or one of whose addresses is in
+        wanted, all of them if wanted is empty
+        """
+        if not wanted:
+            return list(self.options.authors)
+        wanted = {value.lower() for value in wanted}
+        return [author for author in self.options.authors
+                if author.name.lower() in wanted or
+                wanted & {address.strip("'").lower()
+                          for address in author.email}]
+
+    @staticmethod
+    def _month_of(message, months):
+        """
+        Month of months a mail found by a search of months belongs to, None
+        if it is dated in a month between them which was not searched
+        """
+        if not message.day:
+            # Mails without date can not be told apart
+            return months[0]
+        date = message.date
+        month = (date.year, date.month)
+        # Archives of a month may have mails dated a little before or after
+        if month < months[0]:
+            return months[0]
+        if month > months[-1]:
+            return months[-1]
+        return month if month in months else None
+
+    def _search(self, months):
+        """
+        Search months, sorted, cache them and return {month: entry}. Every
+        run of consecutive months is searched in one pass, so that no list
+        walks the months between two runs.
+        """
+        entries = {}
+        for run in consecutive_runs(months):
+            entries.update(self._search_run(run))
+        for month in months:
+            self.cache.put(month, entries[month])
+        return entries
+
+    def _search_run(self, months):
+        """ Search consecutive months in one pass, return {month: entry} """
+        options = self.options.with_months(months)
+        searched = time.time()
+        entries = {month: {'emails': {author: {}
+                                      for author in options.authors},
+                           'incomplete': [], 'searched': searched}
+                   for month in months}
+        for name, retriever in report.run_retrievers(
+                options, resources=self.resources):
+            if retriever is None:
+                for entry in entries.values():
+                    entry['incomplete'].append((name, 'the search failed'))
+                continue
+            for author, author_emails in retriever.emails.items():
+                for message_id, message in author_emails.items():
+                    month = self._month_of(message, months)
+                    if month is None:
+                        continue
+                    emails = entries[month]['emails'][author]
+                    known = emails.setdefault(message_id, message)
+                    if known is not message:
+                        known.merge(message)
+            for month, url in sorted(retriever.incomplete.items()):
+                entries[month]['incomplete'].append((name, url))
+        return entries
+
+    def _entries(self, months):
+        """ Cached entries of months, searching the missing ones """
+        entries = {month: self.cache.get(month) for month in months}
+        missing = [month for month, entry in entries.items()
+                   if entry is None]
+        if missing:
+            with self._search_lock:
+                # Another query may have searched them meanwhile
+                for month in missing:
+                    entries[month] = self.cache.get(month)
+                missing = [month for month in missing
+                           if entries[month] is None]
+                # The months searched are used even if the cache, smaller
+                # than the query, already dropped some of them
+                if missing:
+                    entries.update(self._search(missing))
+        return [entries[month] for month in months]
+
+    def _threads(self, authors, months):
+        """
+        Return (ThreadSet, {author: [messages]}, incomplete) of the mails
+        of authors sent in months
+        """
+        entries = self._entries(months)
+        threads = mail_threads.ThreadSet()
+        found = {}
+        for author in authors:
+            found[author] = [threads.add(message) for entry in entries
+                             for message in entry['emails'].get(
+                                 author, {}).values()]
+        incomplete = [(name, '{0}-{1:02}'.format(*month), reason)
+                      for month, entry in zip(months, entries)
+                      for name, reason in entry['incomplete']]
+        return threads, found, incomplete
+
+    def text(self, authors, months):
+        """ Report of main.py for authors and months """
+        threads, found, incomplete = self._threads(authors, months)
+        output = io.StringIO()
+        for author in authors:
+            if len(authors) > 1:
+                print('{}:'.format(author), file=output)
+            report.print_report(found[author], threads, output)
+        report.print_incomplete(incomplete, output)
+        return output.getvalue()
+
+    def json(self, authors, months):
+        """ Report for authors and months as a dict """
+        threads, found, incomplete = self._threads(authors, months)
+        authors_report = []
+        for author in authors:
+            sections, series = threads.report(found[author])
+            counts = {category: sum(count for count, date, subject in entries)
+                      for category, entries in sections.items()}
+            authors_report.append({
+                'name': author.name,
+                'email': [address.strip("'") for address in author.email],
+                'messages': len(found[author]), 'series': series,
+                'counts': {'patches': counts['patch'],
+                           'replied': counts['reply'],
+                           'others': counts['other']},
+                'patches': self._entries_json(sections['patch']),
+                'replied': self._entries_json(sections['reply']),
+                'others': self._entries_json(sections['other'])})
+        return {'months': ['{0}-{1:02}'.format(*month) for month in months],
+                'authors': authors_report,
+                'incomplete': [{'list': name, 'month': month,
+                                'reason': reason}
+                               for name, month, reason in incomplete]}
+
+    @staticmethod
+    def _entries_json(entries):
+        return [{'count': count, 'date': date and date.isoformat(),
+                 'subject': subject} for count, date, subject in entries]
+
+    def _refresh_loop(self):
+        today = datetime.date.today()
+        months = [(today.year, today.month)]
+        while not self._stop.is_set():
+            with self._search_lock:
+                try:
+                    if months:
+                        self._search(months)
+                except Exception as error:
+                    print("Refresh failed ({0})".format(error),
+                          file=sys.stderr)
+            self._stop.wait(self.refresh)
+            months = sorted(month for month in self.cache.months()
+                            if not month_over(*month) or
+                            (self.cache.get(month) or {}).get('incomplete'))
+
+    def start(self):
+        """
+        Search the current month and refresh the cache in a background
+        thread
+        """
+        self._thread = threading.Thread(target=self._refresh_loop,
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.resources.close()
+
+
+def query_months(query):
+    """
+    Months of a query, from since and until (YYYY-MM), or year and month,
+    the current month by default. Raise ValueError if they are invalid.
+    """
+    if 'since' in query or 'until' in query:
+        today = datetime.date.today()
+        first = dates.parse_month(query.get('since', [''])[0] or
+                                  query['until'][0])
+        last = dates.parse_month(query.get('until', [''])[0] or
+                                 '{0}-{1:02}'.format(today.year, today.month))
+    elif 'year' in query:
+        year = int(query['year'][0])
+        if 'month' in query:
+            first = last = (year, int(query['month'][0]))
+        else:
+            first, last = (year, 1), (year, 12)
+    else:
+        today = datetime.date.today()
+        first = last = (today.year, today.month)
+    if not 1 <= first[1] <= 12 or not 1 <= last[1] <= 12 or first > last:
+        raise ValueError('invalid months')
+    return dates.month_range(first, last)
+
+
+class _ReportHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        service = self.server.service
+        url = urllib.parse.urlsplit(self.path)
+        if url.path not in ('/report', '/report.json'):
+            self._send(404, 'text/plain', 'Not found, ask /report\n')
+            return
+        query = urllib.parse.parse_qs(url.query)
+        try:
+            months = query_months(query)
+        except ValueError as error:
+            self._send(400, 'text/plain', '{0}\n'.format(error))
+            return
+        authors = service.authors(query.get('author', []))
+        if not authors:
+            self._send(404, 'text/plain', 'No such author configured\n')
+            return
+        if url.path == '/report.json' or \
+           query.get('format', [''])[0] == 'json':
+            self._send(200, 'application/json',
+                       json.dumps(service.json(authors, months)))
+        else:
+            self._send(200, 'text/plain; charset=utf-8',
+                       service.text(authors, months))
+
+    def _send(self, status, content_type, text):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Clients of a Unix socket have no address
+        return self.client_address[0] if self.client_address else 'local'
+
+    def log_message(self, format, *args):
+        if self.server.service.options.debug:
+            super().log_message(format, *args)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn,
+                              socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description='Answer report queries, e.g. GET /report?author='
+                        'foo@example.com&since=2016-01&until=2016-03 or '
+                        '/report.json, from mails kept in memory',
+            epilog='Other options are passed to the configuration, as for '
+                   'main.py, e.g. --team')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--socket', help='listen on this Unix socket '
+                                         'rather than on --host and --port')
+    parser.add_argument('--months', type=int, default=60,
+                        help='months kept in memory')
+    parser.add_argument('--refresh-interval', type=float, default=600,
+                        help='seconds between searches of the current '
+                             'month')
+    args, arguments = parser.parse_known_args()
+    today = datetime.date.today()
+    options = config_options.Config(['--year', str(today.year),
+                                     '--month', str(today.month)] +
+                                    arguments)
+    if not options.authors:
+        sys.exit(1)
+    if options.ingest or options.from_index:
+        print("The service keeps its mails in memory, --ingest and "
+              "--from-index are not supported", file=sys.stderr)
+        sys.exit(1)
+    # Pages of the current month are revalidated by every refresh, those
+    # which never change are still never fetched again
+    options.cache_ttl = min(options.cache_ttl, args.refresh_interval)
+    service = ReportService(options, args.months, args.refresh_interval)
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = ThreadingUnixHTTPServer(args.socket, _ReportHandler)
+        address = args.socket
+    else:
+        server = http.server.ThreadingHTTPServer((args.host, args.port),
+                                                 _ReportHandler)
+        address = 'http://{0}:{1}/report'.format(*server.server_address[:2])
+    server.daemon_threads = True
+    server.service = service
+    service.start()
+    print('Answering queries at {0}'.format(address), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+        server.server_close()
+        if args.socket:
+            os.remove(args.socket)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+""" Modules loaded on demand and startup timing """
+
+import contextlib
+import importlib
+import sys
+import time
+
+
+class StartupProfile(object):
+    """
+    Time of the steps of a run. Modules which only some configurations
+    need are imported through load(), so that a run pays only for the
+    lists it searches, and the time of every import is recorded along
+    with the number of modules it brought in.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.started = time.perf_counter()
+        self.steps = []
+
+    def load(self, name):
+        """ Import module name if it is not loaded yet and return it """
+        module = sys.modules.get(name)
+        if module is not None:
+            return module
+        loaded = len(sys.modules)
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        self.steps.append(('import ' + name, time.perf_counter() - start,
+                           len(sys.modules) - loaded))
+        return module
+
+    @contextlib.contextmanager
+    def step(self, label):
+        """ Record the time spent in the with block as label """
+        loaded = len(sys.modules)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps.append((label, time.perf_counter() - start,
+                               len(sys.modules) - loaded))
+
+    def report(self, file=sys.stderr):
+        """ Print the recorded steps if profiling is enabled """
+        if not self.enabled:
+            return
+        print('Startup profile:', file=file)
+        for label, elapsed, modules in self.steps:
+            print('{0:>10.1f} ms {1:>5} modules  {2}'.format(
+                elapsed * 1000, modules, label), file=file)
+        print('{0:>10.1f} ms {1:>5} modules  total'.format(
+            (time.perf_counter() - self.started) * 1000, len(sys.modules)),
+            file=file)
+
+
+profile = StartupProfile()
+load = profile.load
+step = profile.step
@@ -0,0 +1,195 @@
+""" Timing and counters of the work done by the list retrievers """
+
+import collections
+import contextlib
+import io
+import json
+import sys
+import threading
+import time
+
+
+class _Measured(io.RawIOBase):
+    """
+    Raw reader counting the bytes read from body, done(size) is called
+    once when body has been read to the end or is closed
+    """
+    def __init__(self, body, done):
+        self._body = body
+        self._done = done
+        self.size = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = self._body.readinto(buffer)
+        if size:
+            self.size += size
+        else:
+            self._finish()
+        return size
+
+    def _finish(self):
+        if self._done is not None:
+            self._done(self.size)
+            self._done = None
+
+    def close(self):
+        if not self.closed:
+            self._finish()
+            self._body.close()
+        super().close()
+
+
+class Stats(object):
+    """
+    Events of a run, grouped by retriever.
+
+    Every fetch records its url, status, latency (until the response or
+    the cached copy is available), duration (until its body has been read
+    completely), bytes and retries. Parsing of pages and archives and the
+    whole work of every retriever are recorded as spans, and retrievers
+    count the messages they scanned; matched ones are counted as they are
+    found. Times are in seconds from the creation of the Stats.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.events = []
+        self.counters = collections.defaultdict(collections.Counter)
+        self._lock = threading.Lock()
+
+    def now(self):
+        return time.perf_counter() - self.started
+
+    def _add(self, event):
+        event['thread'] = threading.get_ident()
+        with self._lock:
+            self.events.append(event)
+
+    def count(self, retriever, **counts):
+        """ Add counts, e.g. scanned=10, to the counters of retriever """
+        with self._lock:
+            self.counters[retriever].update(counts)
+
+    def fetch(self, retriever, url, status, start, latency, size=0,
+              retries=0):
+        """ Record a fetch which is over """
+        self._add({'kind': 'fetch', 'retriever': retriever, 'name': url,
+                   'status': status, 'start': start,
+                   'duration': self.now() - start, 'latency': latency,
+                   'size': size, 'retries': retries})
+
+    def measure(self, retriever, url, status, start, body, retries=0):
+        """
+        Return body wrapped so that the fetch of url is recorded once body
+        has been read
+        """
+        latency = self.now() - start
+
+        def done(size):
+            self.fetch(retriever, url, status, start, latency, size, retries)
+        return io.BufferedReader(_Measured(body, done),
+                                 buffer_size=64 * 1024)
+
+    @contextlib.contextmanager
+    def span(self, retriever, kind, name):
+        """ Record the time spent in the with block """
+        start = self.now()
+        try:
+            yield
+        finally:
+            self._add({'kind': kind, 'retriever': retriever, 'name': name,
+                       'start': start, 'duration': self.now() - start})
+
+    def summary(self):
+        """ Return {retriever: {total: value}} of every retriever """
+        totals = collections.OrderedDict()
+        with self._lock:
+            events = list(self.events)
+            counters = {retriever: dict(counter)
+                        for retriever, counter in self.counters.items()}
+        for event in sorted(events, key=lambda event: event['start']):
+            total = totals.setdefault(event['retriever'],
+                                      collections.Counter())
+            if event['kind'] == 'fetch':
+                total['requests'] += 1
+                if event['status'] == 'cached':
+                    total['cached'] += 1
+                elif event['status'] == '404':
+                    total['missing'] += 1
+                elif event['status'] != 'revalidated' and \
+                        not event['status'].startswith('2'):
+                    total['errors'] += 1
+                total['bytes'] += event['size']
+                total['retries'] += event['retries']
+                total['fetch_time'] += event['duration']
+                total['max_latency'] = max(total['max_latency'],
+                                           event['latency'])
+            elif event['kind'] == 'parse':
+                total['parse_time'] += event['duration']
+            elif event['kind'] == 'retrieve':
+                total['wall_time'] += event['duration']
+        for retriever, counter in counters.items():
+            totals.setdefault(retriever, collections.Counter()).update(counter)
+        return collections.OrderedDict(
+                (retriever, dict(total))
+                for retriever, total in totals.items())
+
+    def print_table(self, file=sys.stderr, slowest=5):
+        """ Print the summary and the slowest fetches """
+        print('{0:<24} {1:>8} {2:>6} {3:>7} {4:>6} {5:>7} {6:>10} {7:>8} '
+              '{8:>8} {9:>8} {10:>8} {11:>8}'.format(
+                  'list', 'requests', 'cached', 'missing', 'errors',
+                  'retries', 'KiB', 'wall s', 'fetch s', 'parse s',
+                  'scanned', 'matched'), file=file)
+        for retriever, total in self.summary().items():
+            print('{0:<24} {1:>8} {2:>6} {3:>7} {4:>6} {5:>7} {6:>10.0f} '
+                  '{7:>8.2f} {8:>8.2f} {9:>8.2f} {10:>8} {11:>8}'.format(
+                      retriever[:24], total.get('requests', 0),
+                      total.get('cached', 0), total.get('missing', 0),
+                      total.get('errors', 0), total.get('retries', 0),
+                      total.get('bytes', 0) / 1024,
+                      total.get('wall_time', 0), total.get('fetch_time', 0),
+                      total.get('parse_time', 0), total.get('scanned', 0),
+                      total.get('matched', 0)), file=file)
+        fetches = sorted((event for event in self.events
+                          if event['kind'] == 'fetch'),
+                         key=lambda event: event['duration'], reverse=True)
+        if fetches[:slowest]:
+            print('Slowest fetches:', file=file)
+        for event in fetches[:slowest]:
+            print('{0:>8.2f} s {1:>8} {2}'.format(
+                event['duration'], event['status'], event['name']), file=file)
+
+    def write_json(self, path):
+        """ Save the summary and all events as JSON """
+        with open(path, 'w') as json_file:
+            json.dump({'summary': self.summary(), 'events': self.events},
+                      json_file, indent=1)
+
+    def write_trace(self, path):
+        """
+        Save the events in the Trace Event Format read by chrome://tracing,
+        Perfetto and speedscope. Every retriever is shown as a process
+        with its threads.
+        """
+        processes = {}
+        trace = []
+        for event in self.events:
+            if event['retriever'] not in processes:
+                processes[event['retriever']] = len(processes) + 1
+                trace.append({'name': 'process_name', 'ph': 'M',
+                              'pid': processes[event['retriever']],
+                              'args': {'name': event['retriever']}})
+            args = {key: value for key, value in event.items()
+                    if key not in ('kind', 'retriever', 'name', 'start',
+                                   'duration', 'thread')}
+            trace.append({'name': event['name'], 'cat': event['kind'],
+                          'ph': 'X', 'ts': event['start'] * 1e6,
+                          'dur': event['duration'] * 1e6,
+                          'pid': processes[event['retriever']],
+                          'tid': event['thread'], 'args': args})
+        with open(path, 'w') as trace_file:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'},
+                      trace_file)